@@ -0,0 +1,190 @@
+"""
+An in-memory stand-in for the Supabase tables, for benchmarks.
+
+Supports the parts of the query builder the bot uses: select (with one level of
+embedded tables), eq, neq, in_, order, limit, range, insert, upsert, update and delete.
+Every execute() is counted as one data-layer call.
+"""
+import copy
+import re
+import threading
+
+# Embeddable tables: table -> {other table: (column in table, column in other table)}
+RELATIONS = {
+    'rsvps': {'sessions': ('session_id', 'id')},
+    'sessions': {'rsvps': ('id', 'session_id')},
+    'teams': {'team_members': ('id', 'team_id'), 'sessions': ('session_id', 'id')},
+    'team_members': {'teams': ('team_id', 'id')},
+    'player_groups': {'player_group_members': ('id', 'group_id'), 'sessions': ('session_id', 'id')},
+    'player_group_members': {'player_groups': ('group_id', 'id')},
+    'matches': {'sessions': ('session_id', 'id')},
+}
+# Defaults for columns the database fills in
+DEFAULTS = {
+    'users': {'elo': 1000, 'games_played': 0},
+    'sessions': {'completed': False, 'rsvp_message_id': None},
+    'matches': {'completed': False, 'winner_id': None},
+}
+
+
+class Response:
+    def __init__(self, data):
+        self.data = data
+
+
+class MemoryDatabase:
+    """
+    The tables, as lists of rows.
+
+    Attributes:
+        tables (dict[str, list[dict]]): The rows of each table.
+        calls (int): The number of queries executed so far.
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.calls = 0
+        self._next_ids = {}
+        self._lock = threading.Lock()
+
+    def table(self, name: str) -> 'MemoryQuery':
+        return MemoryQuery(self, name)
+
+    def insert_rows(self, name: str, rows: list[dict]) -> list[dict]:
+        table = self.tables.setdefault(name, [])
+        inserted = []
+        for row in rows:
+            row = {**DEFAULTS.get(name, {}), **row}
+            if 'id' not in row:
+                self._next_ids[name] = self._next_ids.get(name, 0) + 1
+                row['id'] = self._next_ids[name]
+            else:
+                self._next_ids[name] = max(self._next_ids.get(name, 0), row['id'])
+            table.append(row)
+            inserted.append(dict(row))
+        return inserted
+
+
+class MemoryQuery:
+    def __init__(self, database: MemoryDatabase, name: str):
+        self.database = database
+        self.name = name
+        self.action = 'select'
+        self.columns = '*'
+        self.values = None
+        self.filters = []
+        self.ordering = []
+        self.start = 0
+        self.stop = None
+
+    def select(self, *columns):
+        self.action = 'select'
+        self.columns = ','.join(columns) if columns else '*'
+        return self
+
+    def insert(self, values):
+        self.action, self.values = 'insert', values
+        return self
+
+    def upsert(self, values):
+        self.action, self.values = 'upsert', values
+        return self
+
+    def update(self, values):
+        self.action, self.values = 'update', values
+        return self
+
+    def delete(self):
+        self.action = 'delete'
+        return self
+
+    def eq(self, column, value):
+        self.filters.append((column, lambda field: field == value))
+        return self
+
+    def neq(self, column, value):
+        self.filters.append((column, lambda field: field is not None and field != value))
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append((column, lambda field: field in values))
+        return self
+
+    def order(self, column, desc=False):
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self.stop = self.start + count
+        return self
+
+    def range(self, start, end):
+        self.start, self.stop = start, end + 1
+        return self
+
+    def execute(self) -> Response:
+        with self.database._lock:
+            self.database.calls += 1
+            return Response(copy.deepcopy(self._run()))
+
+    def _run(self):
+        rows = self.database.tables.setdefault(self.name, [])
+        if self.action in ('insert', 'upsert'):
+            values = self.values if isinstance(self.values, list) else [self.values]
+            if self.action == 'upsert':
+                existing = {row['id']: row for row in rows}
+                updated = [existing[value['id']].update(value) or existing[value['id']] for value in values if value.get('id') in existing]
+                values = [value for value in values if value.get('id') not in existing]
+                return updated + self.database.insert_rows(self.name, values)
+            return self.database.insert_rows(self.name, values)
+
+        embeds = self._embeds()
+        matched = [row for row in rows if self._matches(row, embeds)]
+        if self.action == 'update':
+            for row in matched:
+                row.update(self.values)
+            return matched
+        if self.action == 'delete':
+            deleted = {id(row) for row in matched}
+            self.database.tables[self.name] = [row for row in rows if id(row) not in deleted]
+            return matched
+
+        for column, desc in reversed(self.ordering):
+            matched.sort(key=lambda row: row[column], reverse=desc)
+        matched = matched[self.start:self.stop]
+        return [self._project(row, embeds) for row in matched]
+
+    def _embeds(self) -> dict[str, tuple[list[str], bool]]:
+        embeds = {}
+        for name, inner, columns in re.findall(r'(\w+)(!inner)?\(([^)]*)\)', self.columns):
+            embeds[name] = ([column.strip() for column in columns.split(',')], bool(inner))
+        return embeds
+
+    def _related(self, row, name):
+        column, other_column = RELATIONS[self.name][name]
+        return [other for other in self.database.tables.get(name, []) if other[other_column] == row[column]]
+
+    def _matches(self, row, embeds) -> bool:
+        for column, check in self.filters:
+            if '.' in column:
+                name, column = column.split('.')
+                if not any(check(other.get(column)) for other in self._related(row, name)):
+                    return False
+            elif not check(row.get(column)):
+                return False
+        for name, (_, inner) in embeds.items():
+            if inner and not self._related(row, name):
+                return False
+        return True
+
+    def _project(self, row, embeds) -> dict:
+        plain = re.sub(r'\w+(!inner)?\([^)]*\)', '', self.columns)
+        columns = [column.strip() for column in plain.split(',') if column.strip()]
+        result = dict(row) if '*' in columns else {column: row.get(column) for column in columns}
+        for name, (embed_columns, _) in embeds.items():
+            related = [{column: other.get(column) for column in embed_columns} for other in self._related(row, name)]
+            # Many-to-one relations embed a single row, one-to-many embed a list
+            many_to_one = RELATIONS[self.name][name][1] == 'id'
+            result[name] = (related[0] if related else None) if many_to_one else related
+        return result
@@ -0,0 +1,186 @@
+"""
+Benchmarks form_teams and form_balanced_teams on synthetic sessions.
+
+Each scenario builds a session in an in-memory stand-in for the Supabase tables (or,
+with --backend sqlite, in an in-memory SQLite database) and records the wall time, the number of data-layer calls and the spread between the
+highest and lowest team average ELO. Results are saved as JSON so runs from
+different versions can be compared:
+    python -m benchmarks.team_formation --output before.json
+    python -m benchmarks.team_formation --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import constructors.team_builder as team_builder
+from benchmarks.memory_db import MemoryDatabase
+from db.sqlite import SQLiteClient
+
+# (players, teams, group size, groups, ELO distribution)
+SCENARIOS = [
+    (10, 2, 0, 0, 'normal'),
+    (12, 2, 2, 2, 'normal'),
+    (24, 4, 2, 4, 'uniform'),
+    (30, 4, 3, 3, 'normal'),
+    (40, 4, 4, 2, 'bimodal'),
+    (60, 6, 2, 8, 'normal'),
+    (100, 8, 3, 10, 'uniform'),
+    (100, 8, 0, 0, 'bimodal'),
+    (200, 16, 2, 20, 'normal'),
+    (500, 32, 3, 40, 'normal'),
+    (500, 32, 0, 0, 'bimodal'),
+]
+# Groups and RSVPs of older sessions, so lookups that scan all history show up
+HISTORY_SESSIONS = 50
+# Tables in the order their foreign keys allow them to be filled
+TABLE_ORDER = ('sessions', 'users', 'rsvps', 'player_groups', 'player_group_members')
+
+
+def random_elo(rng: random.Random, distribution: str) -> int:
+    if distribution == 'uniform':
+        return rng.randint(700, 1700)
+    if distribution == 'bimodal':
+        return int(rng.gauss(rng.choice((950, 1450)), 100))
+    return int(rng.gauss(1200, 200))
+
+
+def build_session(players: int, group_size: int, groups: int, distribution: str, seed: int) -> tuple[MemoryDatabase, int]:
+    """
+    Builds a database with one session to form teams for, plus older sessions.
+    :return: The database and the id of the session.
+    """
+    rng = random.Random(seed)
+    database = MemoryDatabase()
+    user_ids = [100000000000000000 + i for i in range(players)]
+    elos = {user_id: random_elo(rng, distribution) for user_id in user_ids}
+    # A few players are new and have no users row yet
+    database.insert_rows('users', [{'id': user_id, 'elo': elo} for user_id, elo in elos.items() if rng.random() > 0.1])
+
+    for _ in range(HISTORY_SESSIONS):
+        session_id = database.insert_rows('sessions', [{'datetime': 'old', 'location': 'gym', 'max_players': players, 'completed': True}])[0]['id']
+        group_id = database.insert_rows('player_groups', [{'session_id': session_id, 'group_name': 'old'}])[0]['id']
+        database.insert_rows('player_group_members', [{'group_id': group_id, 'user_id': user_id} for user_id in rng.sample(user_ids, min(4, players))])
+
+    session_id = database.insert_rows('sessions', [{'datetime': 'now', 'location': 'gym', 'max_players': players}])[0]['id']
+    database.insert_rows('rsvps', [{'session_id': session_id, 'user_id': user_id, 'status': 'confirmed', 'order_position': i}
+                                   for i, user_id in enumerate(user_ids, start=1)])
+    grouped = rng.sample(user_ids, min(players, group_size * groups))
+    for i in range(0, len(grouped), group_size or 1):
+        group_id = database.insert_rows('player_groups', [{'session_id': session_id, 'group_name': f'group {i}'}])[0]['id']
+        database.insert_rows('player_group_members', [{'group_id': group_id, 'user_id': user_id} for user_id in grouped[i:i + group_size]])
+
+    return database, session_id
+
+
+def to_sqlite(database: MemoryDatabase) -> SQLiteClient:
+    """
+    Copies a synthetic session into a fresh in-memory SQLite database.
+    :return: The SQLite client.
+    """
+    client = SQLiteClient(':memory:')
+    for name in TABLE_ORDER:
+        if database.tables.get(name):
+            client.table(name).insert(database.tables[name]).execute()
+    client.calls = 0
+    return client
+
+
+def elo_spread(teams: list[list[int]], client) -> float:
+    elos = {user['id']: user['elo'] for user in client.table('users').select('id, elo').execute().data}
+    averages = [sum(elos[user_id] for user_id in team) / len(team) for team in teams if team]
+    return max(averages) - min(averages) if averages else 0.0
+
+
+async def run_scenario(scenario: tuple, seed: int, backend: str) -> list[dict]:
+    players, num_teams, group_size, groups, distribution = scenario
+    results = []
+    for name in ('form_teams', 'form_balanced_teams'):
+        database, session_id = build_session(players, group_size, groups, distribution, seed)
+        client = to_sqlite(database) if backend == 'sqlite' else database
+        team_builder.get_client = lambda: client
+        random.seed(seed)
+
+        start = time.perf_counter()
+        teams = await getattr(team_builder, name)(session_id, num_teams)
+        elapsed = time.perf_counter() - start
+        calls = client.calls
+        if name == 'form_balanced_teams':
+            teams, _ = teams
+
+        sizes = [len(team) for team in teams]
+        results.append({
+            'function': name,
+            'players': players,
+            'teams': num_teams,
+            'group_size': group_size,
+            'groups': groups,
+            'distribution': distribution,
+            'backend': backend,
+            'seconds': round(elapsed, 4),
+            'db_calls': calls,
+            'elo_spread': round(elo_spread(teams, client), 2),
+            'size_spread': max(sizes) - min(sizes),
+        })
+    return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict], baseline: list[dict]):
+    key = lambda result: (result['function'], result['players'], result['teams'], result['group_size'], result['groups'], result['distribution'])
+    old = {key(result): result for result in baseline}
+    for result in results:
+        before = old.get(key(result))
+        if before is None:
+            continue
+        print(f"{result['function']:20} {result['players']:4}p {result['teams']:3}t  "
+              f"time {before['seconds']:.4f}s -> {result['seconds']:.4f}s  "
+              f"calls {before['db_calls']} -> {result['db_calls']}  "
+              f"spread {before['elo_spread']} -> {result['elo_spread']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark team formation on synthetic sessions.")
+    parser.add_argument('--output', default='team_formation_results.json', help="Where to save the results as JSON.")
+    parser.add_argument('--compare', help="A previous results file to compare against.")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for the synthetic sessions.")
+    parser.add_argument('--backend', choices=('memory', 'sqlite'), default='memory', help="Where to store the synthetic sessions.")
+    args = parser.parse_args()
+
+    results = []
+    for scenario in SCENARIOS:
+        for result in await run_scenario(scenario, args.seed, args.backend):
+            results.append(result)
+            print(f"{result['function']:20} {result['players']:4} players {result['teams']:3} teams "
+                  f"{result['groups']:3}x{result['group_size']} groups {result['distribution']:8} "
+                  f"{result['seconds']:.4f}s {result['db_calls']:3} calls spread {result['elo_spread']}")
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'seed': args.seed,
+        'backend': args.backend,
+        'results': results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Saved results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file)['results'])
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,25 +1,50 @@
+import asyncio
+import io
 import os
 import random
 import re
+import threading
+import time
+from typing import Literal
 
 import discord
 from discord.ext import commands, tasks
 from dotenv import load_dotenv
 
-from constructors.team_builder import form_balanced_teams, form_teams
-from db.supabase import get_supabase_client
-from elo import update_elo
-from event.rsvp import (add_rsvp_db, remove_rsvp_db,
-                        update_rsvp_message)
-from helpers import has_planner_role, has_planner_role_interaction
+from command_sync import (command_tree_hash, forget_scopes, load_state,
+                          sync_changed_scopes, sync_scope)
+from constructors.schedule import (king_of_the_court, order_for_rest,
+                                   round_robin, single_elimination)
+from constructors.team_builder import (form_balanced_teams, form_teams,
+                                       has_completed_matches, save_teams)
+from db.repository import run_query, run_sync
+from db.storage import check_storage_health, get_client
+from elo import glicko_enabled, rate_results, write_results
+from event.refresh import schedule_rsvp_refresh
+from event.rosters import (get_session_groups, get_session_teams,
+                           invalidate_group, invalidate_groups,
+                           invalidate_teams)
+from event.rsvp import add_rsvp_db, remove_rsvp_db
+from event.sessions import (add_active_session, get_active_session,
+                            load_active_sessions, remove_active_session)
+from helpers import (describe_member, has_planner_role,
+                     has_planner_role_interaction, resolve_members)
+from metrics import (count_rest_calls, measure, prometheus_text,
+                     record_startup, startup_report, summary, timed_startup)
+from ranking import (get_leaderboard, get_rank, load_ranking, ranked_players,
+                     update_ranking)
 
 load_dotenv()
 
 # Global Variables
 TOKEN = os.environ.get('DISCORD_TOKEN')
+LEADERBOARD_PAGE_SIZE = 10
+MEASURE_STARTUP = False
+_login_started = time.perf_counter()
 intents = discord.Intents.all()
 intents.message_content = True
 bot = commands.Bot(command_prefix="!", intents=intents)
+count_rest_calls(bot)
 
 
 @bot.event
@@ -29,15 +54,36 @@ async def on_ready():
     :return: None
     """
 
+    record_startup('gateway ready', time.perf_counter() - _login_started)
     print(f'{bot.user} is now running!')
-    keep_supabase_alive.start()
+    # Loading and syncing don't depend on each other, so they run side by side
+    await asyncio.gather(
+        timed_startup('sync commands', sync_commands_on_start()),
+        timed_startup('load active sessions', load_active_sessions()),
+        timed_startup('load ranking', load_ranking()),
+    )
+    if not keep_database_alive.is_running():
+        keep_database_alive.start()
+    if MEASURE_STARTUP:
+        print(startup_report())
+        await bot.close()
+
+async def sync_commands_on_start():
+    try:
+        synced = await sync_changed_scopes(bot.tree, bot.guilds)
+        print(f"Synced commands for {', '.join(synced)}" if synced else "Commands unchanged, skipped sync")
+    except discord.HTTPException as error:
+        print(f"Failed to sync commands: {error}")
 
 @bot.command(name='sync')
-async def sync_commands(ctx):
+async def sync_commands(ctx, force: str = ''):
     if not has_planner_role(ctx): return
     guild = ctx.guild
     ctx.bot.tree.copy_global_to(guild=guild)
-    await ctx.bot.tree.sync(guild=guild)
+    if force != 'force' and load_state().get(str(guild.id)) == command_tree_hash(ctx.bot.tree, guild):
+        await ctx.send("Commands unchanged, nothing to sync! Use !sync force to sync anyway.")
+        return
+    await sync_scope(ctx.bot.tree, guild)
     await ctx.send("Synced!")
 
 @bot.command(name='deletecommands')
@@ -48,12 +94,12 @@ async def delete_commands(ctx):
     ctx.bot.tree.clear_commands(guild=None)
     await ctx.bot.tree.sync()
     await ctx.bot.tree.sync(guild=guild)
+    forget_scopes(None, guild)
     await ctx.send("Cleared!")
 
 @tasks.loop(hours=6)
-async def keep_supabase_alive():
-    supabase_client = get_supabase_client()
-    supabase_client.table('teams').select('*').execute()
+async def keep_database_alive():
+    await run_sync(check_storage_health)
 
 @bot.event
 async def on_raw_reaction_add(payload):
@@ -73,19 +119,33 @@ async def on_raw_reaction_add(payload):
     """
     if payload.member == bot.user:
         return
+    # Only reactions to open sessions' RSVP messages matter, drop the rest without any I/O
+    if payload.emoji.name not in ("✅", "❌") or get_active_session(payload.message_id) is None:
+        return
+
+    await handle_rsvp_reaction(payload)
 
-    channel = bot.get_channel(payload.channel_id)
-    message = await channel.fetch_message(payload.message_id)
+@measure("rsvp-reaction")
+async def handle_rsvp_reaction(payload):
+    """
+    Adds or removes the RSVP for a reaction to an open session's RSVP message.
+    :param payload: The payload of the reaction event.
+    :return: None
+    """
+    # Removing the reaction and editing the embed only need the ids, so skip fetching the message
+    channel = bot.get_partial_messageable(payload.channel_id, guild_id=payload.guild_id)
+    message = channel.get_partial_message(payload.message_id)
 
     if payload.emoji.name == "✅":
-        await add_rsvp_db(message, payload)
+        changed = await add_rsvp_db(message, payload)
         await message.remove_reaction("✅", payload.member)
-        await update_rsvp_message(message)
-        # update rsvp message
+        if changed:
+            schedule_rsvp_refresh(message)
     elif payload.emoji.name == "❌":
-        await remove_rsvp_db(message, payload)
+        changed = await remove_rsvp_db(message, payload)
         await message.remove_reaction("❌", payload.member)
-        await update_rsvp_message(message)
+        if changed:
+            schedule_rsvp_refresh(message)
 
 @bot.event
 async def on_member_join(member):
@@ -102,6 +162,7 @@ async def on_member_join(member):
 
 
 @bot.tree.command(name="clear",description="Clears the specified number of messages.")
+@measure("clear")
 async def clear(interaction: discord.Interaction, value: int):
     """
     Purges the last couple of messages, determined by value.
@@ -124,6 +185,7 @@ async def clear(interaction: discord.Interaction, value: int):
                    delete_after=5)  # Delete the confirmation message after 5 seconds
 
 @bot.tree.command(name="create-session",description="Create a new volleyball session.")
+@measure("create-session")
 async def create_session(interaction: discord.Interaction, date_time: str, location: str, max_players: int):
     """
     Creates a new volleyball session and sends an RSVP message to the channel.
@@ -139,14 +201,14 @@ async def create_session(interaction: discord.Interaction, date_time: str, locat
         The maximum number of players allowed in the session.
     """
     if not await has_planner_role_interaction(interaction): return
-    supabase_client = get_supabase_client()
+    db_client = get_client()
     session_data = {
         'datetime': date_time,
         'location': location,
         'max_players': max_players
     }
-    result = supabase_client.table('sessions').insert(session_data).execute()
-    session_id = result.data[0]['id']
+    result = await run_query(db_client.table('sessions').insert(session_data))
+    session_id = result[0]['id']
 
     # Create and send RSVP message
     event_embed = discord.Embed(
@@ -171,9 +233,11 @@ async def create_session(interaction: discord.Interaction, date_time: str, locat
     await rsvp_message.add_reaction("✅")
     await rsvp_message.add_reaction("❌")
     # Store message ID for later reference
-    supabase_client.table('sessions').update({'rsvp_message_id': rsvp_message.id}).eq('id', session_id).execute()
+    await run_query(db_client.table('sessions').update({'rsvp_message_id': rsvp_message.id}).eq('id', session_id))
+    add_active_session(rsvp_message.id, result[0])
 
 @bot.tree.command(name="list-sessions",description="List all upcoming volleyball sessions.")
+@measure("list-sessions")
 async def list_sessions(interaction: discord.Interaction):
     """
     Lists all upcoming volleyball sessions.
@@ -182,8 +246,8 @@ async def list_sessions(interaction: discord.Interaction):
     interaction : discord.Interaction
         The interaction object.
     """
-    supabase_client = get_supabase_client()
-    sessions = supabase_client.table('sessions').select('*').neq('completed', True).order('id', desc=True).limit(5).execute().data
+    db_client = get_client()
+    sessions = await run_query(db_client.table('sessions').select('*').neq('completed', True).order('id', desc=True).limit(5))
 
     session_embed = discord.Embed(title="Upcoming Volleyball Sessions", color=0x00ff00)
     for session in sessions:
@@ -191,6 +255,7 @@ async def list_sessions(interaction: discord.Interaction):
     await interaction.response.send_message(embed=session_embed)
 
 @bot.tree.command(name="delete-session",description="Delete a volleyball session.")
+@measure("delete-session")
 async def delete_session(interaction: discord.Interaction, session_id: int):
     """
     Deletes a volleyball session.
@@ -202,12 +267,16 @@ async def delete_session(interaction: discord.Interaction, session_id: int):
         The ID of the session to delete.
     """
     if not await has_planner_role_interaction(interaction): return
-    supabase_client = get_supabase_client()
-    supabase_client.table('rsvps').delete().eq('session_id', session_id).execute()
-    supabase_client.table('sessions').delete().eq('id', session_id).execute()
+    db_client = get_client()
+    await run_query(db_client.table('rsvps').delete().eq('session_id', session_id))
+    await run_query(db_client.table('sessions').delete().eq('id', session_id))
+    remove_active_session(session_id)
+    invalidate_teams(session_id)
+    invalidate_groups(session_id)
     await interaction.response.send_message(f"Session {session_id} has been deleted.")
 
 @bot.tree.command(name="end-session",description="End a volleyball session.")
+@measure("end-session")
 async def end_session(interaction: discord.Interaction, session_id: int):
     """
     Ends a volleyball session.
@@ -219,11 +288,23 @@ async def end_session(interaction: discord.Interaction, session_id: int):
         The ID of the session to end.
     """
     if not await has_planner_role_interaction(interaction): return
-    supabase_client = get_supabase_client()
-    supabase_client.table('sessions').update({'completed': True}).eq('id', session_id).execute()
+    db_client = get_client()
+    ended = await run_query(db_client.table('sessions').update({'completed': True}).eq('id', session_id).neq('completed', True))
+    remove_active_session(session_id)
     await interaction.response.send_message(f"Session {session_id} has been ended.")
+    if not ended:
+        return
+    # Rating modules are only imported once a session ends, Glicko-2 needs numpy
+    if glicko_enabled():
+        from glicko import rate_session
+        # The whole session is one rating period
+        update_ranking(await rate_session(session_id))
+    else:
+        from replay import checkpoint_ratings
+        await run_sync(checkpoint_ratings, db_client)
 
 @bot.tree.command(name="add-players", description="Add players to the volleyball session player list.")
+@measure("add-players")
 async def add_players(interaction: discord.Interaction, session_id: int, players: str):
     """
     Adds players to the volleyball session player list.
@@ -237,15 +318,24 @@ async def add_players(interaction: discord.Interaction, session_id: int, players
         The list of player IDs to add.
     """
     if not await has_planner_role_interaction(interaction): return
-    supabase_client = get_supabase_client()
+    db_client = get_client()
     # Get the list of players from string of mentions
     players = [int(re.findall(r'\d+', player)[0]) for player in players.split()]
-    player_names = [interaction.guild.get_member(player).name for player in players]
-    for player in players:
-        supabase_client.table('rsvps').insert({'session_id': session_id, 'user_id': player, 'status': 'confirmed', 'order_position': random.randint(-10000, -1)}).execute()
+    members = await resolve_members(interaction.guild, players)
+    player_names = [members[player].name if members[player] else f"<@{player}>" for player in players]
+    # Skip players who already RSVP'd, so nobody ends up on the list twice
+    existing = await run_query(db_client.table('rsvps').select('user_id').eq('session_id', session_id).in_('user_id', players))
+    existing_ids = {rsvp['user_id'] for rsvp in existing}
+    new_players = [player for player in dict.fromkeys(players) if player not in existing_ids]
+    if new_players:
+        await run_query(db_client.table('rsvps').insert([
+            {'session_id': session_id, 'user_id': player, 'status': 'confirmed', 'order_position': random.randint(-10000, -1)}
+            for player in new_players
+        ]))
     await interaction.response.send_message(f"Players {', '.join(player_names)} have been added to session {session_id}.")
 
 @bot.tree.command(name="remove-players", description="Remove players from the volleyball session player list.")
+@measure("remove-players")
 async def remove_players(interaction: discord.Interaction, session_id: int, players: str):
     """
     Removes players from the volleyball session player list.
@@ -259,15 +349,22 @@ async def remove_players(interaction: discord.Interaction, session_id: int, play
         The list of player IDs to remove.
     """
     if not await has_planner_role_interaction(interaction): return
-    supabase_client = get_supabase_client()
+    db_client = get_client()
     # Get the list of players from string of mentions
     players = [int(re.findall(r'\d+', player)[0]) for player in players.split()]
-    player_names = [await interaction.guild.fetch_member(player).name for player in players]
-    for player in players:
-        supabase_client.table('rsvps').delete().eq('session_id', session_id).eq('user_id', player).execute()
+    members = await resolve_members(interaction.guild, players)
+    player_names = [members[player].name if members[player] else f"<@{player}>" for player in players]
+    removed = await run_query(db_client.table('rsvps').delete().eq('session_id', session_id).in_('user_id', players))
+    # Promote the first waitlisted players into the confirmed spots that opened up, like rsvp_remove
+    opened = len({rsvp['user_id'] for rsvp in removed if rsvp['status'] == 'confirmed'})
+    if opened:
+        waitlist = await run_query(db_client.table('rsvps').select('id').eq('session_id', session_id).eq('status', 'waitlist').order('order_position').limit(opened))
+        if waitlist:
+            await run_query(db_client.table('rsvps').update({'status': 'confirmed'}).in_('id', [rsvp['id'] for rsvp in waitlist]))
     await interaction.response.send_message(f"Players {', '.join(player_names)} have been removed from session {session_id}.")
 
 @bot.tree.command(name="list-players", description="List the players in the volleyball session player list.")
+@measure("list-players")
 async def list_players(interaction: discord.Interaction, session_id: int):
     """
     Lists the players in the volleyball session player list.
@@ -278,14 +375,15 @@ async def list_players(interaction: discord.Interaction, session_id: int):
     session_id : int
         The ID of the session.
     """
-    supabase_client = get_supabase_client()
-    players = supabase_client.table('rsvps').select('user_id', 'status').eq('session_id', session_id).execute().data
+    db_client = get_client()
+    players = await run_query(db_client.table('rsvps').select('user_id', 'status').eq('session_id', session_id))
     player_list = [f"<@{player['user_id']}>" for player in players if player['status'] == 'confirmed']
     waitlist = [f"<@{player['user_id']}>" for player in players if player['status'] == 'waitlist']
     embed = discord.Embed(title=f"Players in session {session_id}", color=0x00ff00).add_field(name="Confirmed", value=", ".join(player_list), inline=False).add_field(name="Waitlist", value=", ".join(waitlist), inline=False)
     await interaction.response.send_message(embed=embed)
 
 @bot.tree.command(name="create-teams", description="Create teams for the volleyball session.")
+@measure("create-teams")
 async def create_teams(interaction: discord.Interaction, session_id: int, num_teams: int = 2):
     """
     Creates teams for the volleyball session.
@@ -299,34 +397,23 @@ async def create_teams(interaction: discord.Interaction, session_id: int, num_te
         The number of teams to create.
     """
     if not await has_planner_role_interaction(interaction): return
+    if await has_completed_matches(session_id):
+        await interaction.response.send_message(f"Session {session_id} already has completed matches, its teams can't be re-formed.")
+        return
     await interaction.response.defer()
-    supabase_client = get_supabase_client()
-    supabase_client.table('team_members').delete().neq('id', -1).execute()
-    supabase_client.table('matches').delete().eq('session_id', session_id).execute()
-    supabase_client.table('teams').delete().eq('session_id', session_id).execute()
-    teams = form_teams(session_id, num_teams)
-    # Store teams in the database
-    for i, team in enumerate(teams, start=1):
-        team_data = {'session_id': session_id, 'team_number': i}
-        team_result = supabase_client.table('teams').insert(team_data).execute().data[0]
-
-        for player in team:
-            supabase_client.table('team_members').insert({
-                'team_id': team_result['id'],
-                'user_id': player
-            }).execute()
+    teams = await form_teams(session_id, num_teams)
+    await save_teams(session_id, teams)
 
     # Display teams
     embed = discord.Embed(title=f"Session {session_id} Teams", color=0x00ff00)
-    for team_member_ids in teams:
-        team_members = [await interaction.guild.fetch_member(user_id) for user_id in team_member_ids]
-        team_members_name = [member.name for member in team_members]
-        team_members_mention = [member.mention for member in team_members]
-        team_members_name_mention = [f"{team_members_name[i]} ({team_members_mention[i]})" for i in range(len(team_members_name))]
-        embed.add_field(name=f"Team {teams.index(team_member_ids) + 1}", value="\n".join(team_members_name_mention), inline=False)
+    members = await resolve_members(interaction.guild, [user_id for team in teams for user_id in team])
+    for i, team_member_ids in enumerate(teams, start=1):
+        team_members_name_mention = [describe_member(members[user_id], user_id) for user_id in team_member_ids]
+        embed.add_field(name=f"Team {i}", value="\n".join(team_members_name_mention), inline=False)
     await interaction.followup.send(embed=embed)
 
 @bot.tree.command(name="create-balanced-teams", description="Create balanced teams for the volleyball session.")
+@measure("create-balanced-teams")
 async def create_balanced_teams(interaction: discord.Interaction, session_id: int, num_teams: int = 2):
     """
     Creates balanced teams for the volleyball session.
@@ -340,35 +427,24 @@ async def create_balanced_teams(interaction: discord.Interaction, session_id: in
         The number of teams to create.
     """
     if not await has_planner_role_interaction(interaction): return
+    if await has_completed_matches(session_id):
+        await interaction.response.send_message(f"Session {session_id} already has completed matches, its teams can't be re-formed.")
+        return
     await interaction.response.defer()
-    supabase_client = get_supabase_client()
-    supabase_client.table('team_members').delete().neq('id', -1).execute()
-    supabase_client.table('matches').delete().eq('session_id', session_id).execute()
-    supabase_client.table('teams').delete().eq('session_id', session_id).execute()
-    teams = form_balanced_teams(session_id, num_teams)
-
-    # Store teams in the database
-    for i, team in enumerate(teams, start=1):
-        team_data = {'session_id': session_id, 'team_number': i}
-        team_result = supabase_client.table('teams').insert(team_data).execute().data[0]
-
-        for player in team:
-            supabase_client.table('team_members').insert({
-                'team_id': team_result['id'],
-                'user_id': player
-            }).execute()
+    teams, spread = await form_balanced_teams(session_id, num_teams)
+    await save_teams(session_id, teams)
 
     # Display teams
     embed = discord.Embed(title=f"Session {session_id} Teams", color=0x00ff00)
-    for team_member_ids in teams:
-        team_members = [await interaction.guild.fetch_member(user_id) for user_id in team_member_ids]
-        team_members_name = [member.name for member in team_members]
-        team_members_mention = [member.mention for member in team_members]
-        team_members_name_mention = [f"{team_members_name[i]} ({team_members_mention[i]})" for i in range(len(team_members_name))]
-        embed.add_field(name=f"Team {teams.index(team_member_ids) + 1}", value="\n".join(team_members_name_mention), inline=False)
+    members = await resolve_members(interaction.guild, [user_id for team in teams for user_id in team])
+    for i, team_member_ids in enumerate(teams, start=1):
+        team_members_name_mention = [describe_member(members[user_id], user_id) for user_id in team_member_ids]
+        embed.add_field(name=f"Team {i}", value="\n".join(team_members_name_mention), inline=False)
+    embed.set_footer(text=f"Average ELO spread between teams: {spread:.1f}")
     await interaction.followup.send(embed=embed)
 
 @bot.tree.command(name="list-teams", description="List the teams for the volleyball session.")
+@measure("list-teams")
 async def list_teams(interaction: discord.Interaction, session_id: int):
     """
     Lists the teams for the volleyball session.
@@ -379,15 +455,18 @@ async def list_teams(interaction: discord.Interaction, session_id: int):
     session_id : int
         The ID of the session.
     """
-    supabase_client = get_supabase_client()
-    teams = supabase_client.table('teams').select('*').eq('session_id', session_id).execute().data
+    teams = await get_session_teams(session_id)
+    if not teams:
+        await interaction.response.send_message("No teams found.")
+        return
     embed = discord.Embed(title=f"Session {session_id} Teams")
+    members = await resolve_members(interaction.guild, [user_id for team in teams for user_id in team['members']])
     for team in teams:
-        team_members = supabase_client.table('team_members').select('user_id').eq('team_id', team['id']).execute().data
-        embed.add_field(name=f"Team {team['team_number']}", value=", ".join([interaction.guild.get_member(member['user_id']).mention for member in team_members]), inline=False)
-    await interaction.response.send_message(embed=embed or "No teams found.")
+        embed.add_field(name=f"Team {team['team_number']}", value=", ".join([describe_member(members[user_id], user_id) for user_id in team['members']]), inline=False)
+    await interaction.response.send_message(embed=embed)
 
 @bot.tree.command(name="move-player", description="Move a player from one team to another team")
+@measure("move-player")
 async def move_player(interaction: discord.Interaction, session_id: int, player: discord.Member, team_number: int):
     """
     Move a player from one team to another team
@@ -403,12 +482,23 @@ async def move_player(interaction: discord.Interaction, session_id: int, player:
         The number of the team to move the player to.
     """
     if not await has_planner_role_interaction(interaction): return
-    supabase_client = get_supabase_client()
-    team = supabase_client.table('teams').select('id').eq('session_id', session_id).eq('team_number', team_number).execute().data[0]
-    supabase_client.table('team_members').update({'team_id': team['id']}).eq('user_id', player.id).execute()
+    # Rated matches were rated with the current rosters, a replay has to see the same players
+    if await has_completed_matches(session_id):
+        await interaction.response.send_message(f"Session {session_id} already has completed matches, its teams can't be changed.")
+        return
+    db_client = get_client()
+    teams = await run_query(db_client.table('teams').select('id, team_number').eq('session_id', session_id))
+    team = next((team for team in teams if team['team_number'] == team_number), None)
+    if team is None:
+        await interaction.response.send_message(f"Session {session_id} has no Team {team_number}.")
+        return
+    # Only move the player within this session, older sessions keep their rosters
+    await run_query(db_client.table('team_members').update({'team_id': team['id']}).eq('user_id', player.id).in_('team_id', [team['id'] for team in teams]))
+    invalidate_teams(session_id)
     await interaction.response.send_message(f"Player {player.name} has been moved to team {team_number}.")
 
 @bot.tree.command(name="create-group", description="Create a new group.")
+@measure("create-group")
 async def create_group(interaction: discord.Interaction, session_id: int, group_name: str, members: str):
     """
     Creates a new group.
@@ -424,25 +514,27 @@ async def create_group(interaction: discord.Interaction, session_id: int, group_
         The list of members in the group.
     """
     if not await has_planner_role_interaction(interaction): return
-    supabase_client = get_supabase_client()
+    db_client = get_client()
     # Create a new group
-    group = supabase_client.table('player_groups').insert({
+    group = (await run_query(db_client.table('player_groups').insert({
         'session_id': session_id,
         'group_name': group_name
-    }).execute().data[0]
+    })))[0]
     members = [int(re.findall(r'\d+', member)[0]) for member in members.split()]
     # Add members to the group
     for member in members:
         member = interaction.guild.get_member(member)
-        supabase_client.table('player_group_members').insert({
+        await run_query(db_client.table('player_group_members').insert({
             'group_id': group['id'],
             'user_id': member.id
-        }).execute()
+        }))
+    invalidate_groups(session_id)
     embed = discord.Embed(title=f"Group {group_name}", color=0x00ff00)
     embed.add_field(name="Members", value=", ".join([interaction.guild.get_member(member).mention for member in members]), inline=False)
     await interaction.response.send_message(embed=embed)
 
 @bot.tree.command(name="list-groups", description="List the groups for the volleyball session.")
+@measure("list-groups")
 async def list_groups(interaction: discord.Interaction, session_id: int):
     """
     Lists the groups for the volleyball session.
@@ -453,15 +545,18 @@ async def list_groups(interaction: discord.Interaction, session_id: int):
     session_id : int
         The ID of the session.
     """
-    supabase_client = get_supabase_client()
-    groups = supabase_client.table('player_groups').select('*').eq('session_id', session_id).execute().data
+    groups = await get_session_groups(session_id)
+    if not groups:
+        await interaction.response.send_message("No groups found.")
+        return
     embed = discord.Embed(title=f"Session {session_id} Groups")
+    members = await resolve_members(interaction.guild, [user_id for group in groups for user_id in group['members']])
     for group in groups:
-        group_members = supabase_client.table('player_group_members').select('user_id').eq('group_id', group['id']).execute().data
-        embed.add_field(name=f"Group {group['group_name']} ({group['id']})", value=", ".join([interaction.guild.get_member(member['user_id']).mention for member in group_members]), inline=False)
-    await interaction.response.send_message(embed=embed or "No groups found.")
+        embed.add_field(name=f"Group {group['group_name']} ({group['id']})", value=", ".join([describe_member(members[user_id], user_id) for user_id in group['members']]), inline=False)
+    await interaction.response.send_message(embed=embed)
 
 @bot.tree.command(name="add-group-members", description="Add members to a group.")
+@measure("add-group-members")
 async def add_group_members(interaction: discord.Interaction, group_id: int, members: str):
     """
     Add members to a group.
@@ -475,19 +570,21 @@ async def add_group_members(interaction: discord.Interaction, group_id: int, mem
         The list of members to add to the group.
     """
     if not await has_planner_role_interaction(interaction): return
-    supabase_client = get_supabase_client()
+    db_client = get_client()
     members = [int(re.findall(r'\d+', member)[0]) for member in members.split()]
     members_mention = [interaction.guild.get_member(member).mention for member in members]
     for member in members:
         member = interaction.guild.get_member(member)
-        supabase_client.table('player_group_members').insert({
+        await run_query(db_client.table('player_group_members').insert({
             'group_id': group_id,
             'user_id': member.id
-        }).execute()
+        }))
+    invalidate_group(group_id)
 
     await interaction.response.send_message(f"Members {', '.join(members_mention)} have been added to group {group_id}.")
 
 @bot.tree.command(name="remove-group-members", description="Remove members from a group.")
+@measure("remove-group-members")
 async def remove_group_members(interaction: discord.Interaction, group_id: int, members: str):
     """
     Remove members from a group.
@@ -501,15 +598,17 @@ async def remove_group_members(interaction: discord.Interaction, group_id: int,
         The list of members to remove from the group.
     """
     if not await has_planner_role_interaction(interaction): return
-    supabase_client = get_supabase_client()
+    db_client = get_client()
     members = [int(re.findall(r'\d+', member)[0]) for member in members.split()]
     members_mention = [interaction.guild.get_member(member).mention for member in members]
     for member in members:
         member = interaction.guild.get_member(member)
-        supabase_client.table('player_group_members').delete().eq('group_id', group_id).eq('user_id', member.id).execute()
+        await run_query(db_client.table('player_group_members').delete().eq('group_id', group_id).eq('user_id', member.id))
+    invalidate_group(group_id)
     await interaction.response.send_message(f"Members {', '.join(members_mention)} have been removed from group {group_id}.")
 
 @bot.tree.command(name="delete-group", description="Delete a group.")
+@measure("delete-group")
 async def delete_group(interaction: discord.Interaction, group_id: int):
     """
     Deletes a group.
@@ -521,12 +620,14 @@ async def delete_group(interaction: discord.Interaction, group_id: int):
         The ID of the group to delete.
     """
     if not await has_planner_role_interaction(interaction): return
-    supabase_client = get_supabase_client()
-    supabase_client.table('player_group_members').delete().eq('group_id', group_id).execute()
-    supabase_client.table('player_groups').delete().eq('id', group_id).execute()
+    db_client = get_client()
+    await run_query(db_client.table('player_group_members').delete().eq('group_id', group_id))
+    await run_query(db_client.table('player_groups').delete().eq('id', group_id))
+    invalidate_group(group_id)
     await interaction.response.send_message(f"Group {group_id} has been deleted.")
 
 @bot.tree.command(name="create-match", description="Creates a match for the volleyball session.")
+@measure("create-match")
 async def create_match(interaction: discord.Interaction, session_id: int, team_1: int, team_2: int):
     """
     Creates a match for the volleyball session.
@@ -542,19 +643,91 @@ async def create_match(interaction: discord.Interaction, session_id: int, team_1
         The number of the second team.
     """
     if not await has_planner_role_interaction(interaction): return
-    supabase_client = get_supabase_client()
-    teams = supabase_client.table('teams').select('id, team_number').eq('session_id', session_id).execute().data
+    db_client = get_client()
+    teams = await run_query(db_client.table('teams').select('id, team_number').eq('session_id', session_id))
     team_1_id = next(team['id'] for team in teams if team['team_number'] == team_1)
     team_2_id = next(team['id'] for team in teams if team['team_number'] == team_2)
 
-    supabase_client.table('matches').insert({
+    await run_query(db_client.table('matches').insert({
         'session_id': session_id,
         'team1_id': team_1_id,
         'team2_id': team_2_id,
-    }).execute()
+    }))
     await interaction.response.send_message(f"Match created with for Team {team_1} against {team_2}. Good luck!")
 
+@bot.tree.command(name="generate-schedule", description="Create every match of the night for the session's teams.")
+@measure("generate-schedule")
+async def generate_schedule(interaction: discord.Interaction, session_id: int,
+                            schedule_format: Literal['round-robin', 'king-of-the-court', 'single-elimination'] = 'round-robin',
+                            replace: bool = False):
+    """
+    Creates every match of the night for the session's teams in one go.
+    Parameters
+    ----------
+    interaction : discord.Interaction
+        The interaction object.
+    session_id : int
+        The ID of the session.
+    schedule_format : str
+        round-robin, king-of-the-court or single-elimination.
+    replace : bool
+        Delete the session's matches without a result first.
+    """
+    if not await has_planner_role_interaction(interaction): return
+    db_client = get_client()
+    teams, matches = await asyncio.gather(
+        run_query(db_client.table('teams').select('id, team_number').eq('session_id', session_id).order('team_number')),
+        run_query(db_client.table('matches').select('id, completed').eq('session_id', session_id)),
+    )
+    if len(teams) < 2:
+        await interaction.response.send_message("Create at least two teams for this session first.")
+        return
+    open_matches = [match['id'] for match in matches if not match['completed']]
+    if open_matches and not replace:
+        await interaction.response.send_message(f"Session {session_id} already has {len(open_matches)} scheduled matches, use replace to start over.")
+        return
+
+    team_numbers = [team['team_number'] for team in teams]
+    team_ids = {team['team_number']: team['id'] for team in teams}
+    later_rounds = []
+    if schedule_format == 'round-robin':
+        rounds = order_for_rest(round_robin(team_numbers))
+    elif schedule_format == 'king-of-the-court':
+        rounds = king_of_the_court(team_numbers)
+    else:
+        first_round, later_rounds = single_elimination(team_numbers)
+        rounds = [first_round]
+
+    if open_matches:
+        await run_query(db_client.table('matches').delete().in_('id', open_matches))
+    # Matches are inserted in playing order, so their ids follow the schedule
+    created = await run_query(db_client.table('matches').insert([
+        {'session_id': session_id, 'team1_id': team_ids[team_1], 'team2_id': team_ids[team_2]}
+        for matches_in_round in rounds for team_1, team_2 in matches_in_round
+    ]))
+
+    embed = discord.Embed(title=f"{schedule_format.replace('-', ' ').title()} Schedule", color=0x00ff00)
+    lines, created, game = [], iter(created), 0
+    for round_number, matches_in_round in enumerate(rounds, start=1):
+        if schedule_format != 'king-of-the-court':
+            lines.append(f"**Round {round_number}**")
+        for team_1, team_2 in matches_in_round:
+            game += 1
+            # Bracket games are numbered so later rounds can refer to them
+            prefix = f"Game {game} (Match {next(created)['id']})" if schedule_format == 'single-elimination' else f"Match {next(created)['id']}"
+            lines.append(f"{prefix}: Team {team_1} vs Team {team_2}")
+    for round_number, pairs in enumerate(later_rounds, start=2):
+        lines.append(f"**Round {round_number}**")
+        for team_1, team_2 in pairs:
+            game += 1
+            lines.append(f"Game {game}: {team_1} vs {team_2}")
+    embed.description = "\n".join(lines)[:4096]
+    if later_rounds:
+        embed.set_footer(text="Create later rounds with /create-match once their teams are known")
+    await interaction.response.send_message(embed=embed)
+
 @bot.tree.command(name="list-matches", description="List the matches scheduled for the volleyball session.")
+@measure("list-matches")
 async def list_matches(interaction: discord.Interaction, session_id: int):
     """
     Lists the matches scheduled for the volleyball session.
@@ -565,9 +738,9 @@ async def list_matches(interaction: discord.Interaction, session_id: int):
     session_id : int
         The ID of the session.
     """
-    supabase_client = get_supabase_client()
+    db_client = get_client()
     # Get all matches for the session
-    matches = supabase_client.table('matches').select('*').eq('session_id', session_id).neq('completed', True).execute().data
+    matches = await run_query(db_client.table('matches').select('*').eq('session_id', session_id).neq('completed', True))
 
     if not matches:
         await interaction.response.send_message("No matches scheduled for this session.")
@@ -575,7 +748,7 @@ async def list_matches(interaction: discord.Interaction, session_id: int):
 
     # Get team names
     team_ids = set(match['team1_id'] for match in matches) | set(match['team2_id'] for match in matches)
-    teams = supabase_client.table('teams').select('*').in_('id', list(team_ids)).execute().data
+    teams = await run_query(db_client.table('teams').select('*').in_('id', list(team_ids)))
     team_names = {team['id']: f"Team {team['team_number']}" for team in teams}
 
     # Create schedule message
@@ -587,6 +760,7 @@ async def list_matches(interaction: discord.Interaction, session_id: int):
     await interaction.response.send_message(embed=embed or "No matches found.")
 
 @bot.tree.command(name="winner", description="Declare the winning team.")
+@measure("winner")
 async def winner(interaction: discord.Interaction, session_id: int, match_number: int, winning_team_number: int):
     """
     Declare the winning team.
@@ -602,20 +776,268 @@ async def winner(interaction: discord.Interaction, session_id: int, match_number
         The number of the winning team.
     """
     if not await has_planner_role_interaction(interaction): return
-    await interaction.defer()
-    supabase_client = get_supabase_client()
-    match = supabase_client.table('matches').select('*').eq('session_id', session_id).eq('id', match_number).neq('completed', True).execute().data
+    await interaction.response.defer()
+    results, errors = await load_results(session_id, [(match_number, winning_team_number)])
+    if errors:
+        await interaction.followup.send(errors[0])
+        return
+
+    await save_results(results)
+    await interaction.followup.send(f"Team {winning_team_number} has been declared the winner for Match {match_number}, congrats!")
+
+@bot.tree.command(name="winners", description="Declare the winning teams of several matches, ex. 12:1 13:3")
+@measure("winners")
+async def winners(interaction: discord.Interaction, session_id: int, results: str):
+    """
+    Declare the winning teams of several matches at once. Nothing is saved unless every result is valid.
+    Parameters
+    ----------
+    interaction : discord.Interaction
+        The interaction object.
+    session_id : int
+        The ID of the session.
+    results : str
+        Match number and winning team number pairs, ex. "12:1 34:4 13:3".
+    """
+    if not await has_planner_role_interaction(interaction): return
+    await interaction.response.defer()
+    pairs, errors = [], []
+    for token in results.replace(',', ' ').split():
+        match = re.fullmatch(r'(\d+):(\d+)', token)
+        if match:
+            pairs.append((int(match.group(1)), int(match.group(2))))
+        else:
+            errors.append(f"`{token}` is not a result, use match:team like 12:1")
+    if not pairs and not errors:
+        errors.append("No results given, use match:team pairs like 12:1 34:4")
+    if not errors:
+        pairs, errors = await load_results(session_id, pairs)
+    if errors:
+        await interaction.followup.send("Nothing was saved:\n" + "\n".join(errors))
+        return
+
+    await save_results(pairs)
+    lines = [f"Match {match['id']}: Team {team_number} wins" for match, team_number in pairs]
+    await interaction.followup.send(f"Saved {len(pairs)} results, congrats!\n" + "\n".join(lines))
+
+async def load_results(session_id: int, pairs: list[tuple[int, int]]) -> tuple[list[tuple[dict, int]], list[str]]:
+    """
+    Checks match results before any of them are saved.
+    :param session_id: The ID of the session.
+    :param pairs: The match numbers and winning team numbers.
+    :return: The matches, with winner_id set, paired with their winning team number and
+    sorted by match, and a message for every invalid result.
+    """
+    db_client = get_client()
+    match_ids = [match_id for match_id, _ in pairs]
+    matches, teams = await asyncio.gather(
+        run_query(db_client.table('matches').select('*').eq('session_id', session_id).in_('id', match_ids)),
+        run_query(db_client.table('teams').select('id, team_number').eq('session_id', session_id)),
+    )
+    matches = {match['id']: match for match in matches}
+    team_ids = {team['team_number']: team['id'] for team in teams}
+
+    results, errors = [], []
+    for match_id, team_number in pairs:
+        match = matches.get(match_id)
+        if match_ids.count(match_id) > 1:
+            errors.append(f"Match {match_id} has more than one result")
+        elif match is None or match['completed']:
+            errors.append(f"Match {match_id} does not exist or already has been submitted")
+        elif team_ids.get(team_number) not in (match['team1_id'], match['team2_id']):
+            errors.append(f"Team {team_number} did not play in Match {match_id}")
+        else:
+            results.append(({**match, 'completed': True, 'winner_id': team_ids[team_number]}, team_number))
+    return sorted(results, key=lambda result: result[0]['id']), list(dict.fromkeys(errors))
+
+async def save_results(results: list[tuple[dict, int]]):
+    """
+    Marks matches completed with their winners and rates them in match order, in one transaction.
+    Ratings are applied in match order, so if a later match was already rated, the matches
+    from the nearest checkpoint are replayed instead. With Glicko-2 nothing is rated until the session ends.
+    :param results: The matches, with winner_id set, from load_results().
+    :return: None
+    """
+    db_client = get_client()
+    matches = [match for match, _ in results]
+    if glicko_enabled():
+        # Glicko-2 rates the whole session when it ends
+        await write_results(matches)
+        return
+    first_match_id = matches[0]['id']
+    later = await run_query(db_client.table('rating_history').select('match_id').gt('match_id', first_match_id).limit(1))
+    if later:
+        # The replay rewrites every rating after the checkpoint, so it runs once the results are saved.
+        # If it fails, /correct-match with the same winner runs it again.
+        await write_results(matches)
+        from replay import recompute_ratings
+        update_ranking(await run_sync(recompute_ratings, db_client, first_match_id))
+    else:
+        await rate_results(matches)
+
+@bot.tree.command(name="correct-match", description="Change the winner of a completed match and recompute ratings.")
+@measure("correct-match")
+async def correct_match(interaction: discord.Interaction, session_id: int, match_number: int, winning_team_number: int):
+    """
+    Change the winner of a completed match. Ratings are replayed from the nearest checkpoint before the match.
+    Parameters
+    ----------
+    interaction : discord.Interaction
+        The interaction object.
+    session_id : int
+        The ID of the session.
+    match_number : int
+        The number of the match.
+    winning_team_number : int
+        The number of the team that actually won.
+    """
+    if not await has_planner_role_interaction(interaction): return
+    await interaction.response.defer()
+    db_client = get_client()
+    match, winning_team = await asyncio.gather(
+        run_query(db_client.table('matches').select('*').eq('session_id', session_id).eq('id', match_number).eq('completed', True)),
+        run_query(db_client.table('teams').select('id').eq('session_id', session_id).eq('team_number', winning_team_number)),
+    )
+    if not match or not winning_team or winning_team[0]['id'] not in (match[0]['team1_id'], match[0]['team2_id']):
+        await interaction.followup.send(f"Match {match_number} has no result yet or Team {winning_team_number} did not play in it.")
+        return
+
+    await run_query(db_client.table('matches').update({'winner_id': winning_team[0]['id']}).eq('id', match_number))
+    if glicko_enabled():
+        await interaction.followup.send(f"Team {winning_team_number} is now the winner of Match {match_number}.")
+        return
+    from replay import recompute_ratings
+    update_ranking(await run_sync(recompute_ratings, db_client, match_number))
+    await interaction.followup.send(f"Team {winning_team_number} is now the winner of Match {match_number}, ratings have been recomputed.")
+
+@bot.tree.command(name="delete-match", description="Delete a match, recomputing ratings if it had a result.")
+@measure("delete-match")
+async def delete_match(interaction: discord.Interaction, session_id: int, match_number: int):
+    """
+    Delete a match. If it had a result, ratings are replayed from the nearest checkpoint before the match.
+    Parameters
+    ----------
+    interaction : discord.Interaction
+        The interaction object.
+    session_id : int
+        The ID of the session.
+    match_number : int
+        The number of the match.
+    """
+    if not await has_planner_role_interaction(interaction): return
+    await interaction.response.defer()
+    db_client = get_client()
+    match = await run_query(db_client.table('matches').delete().eq('session_id', session_id).eq('id', match_number))
     if not match:
-        await interaction.response.send_message(f"Match {match_number} does not exist or already has been submitted")
+        await interaction.followup.send(f"Match {match_number} does not exist.")
         return
-    match = match[0]
 
-    winning_team_id = supabase_client.table('teams').select('id').eq('session_id', session_id).eq('team_number', winning_team_number).execute().data[0]['id']
-    losing_team_id = match['team1_id'] if match['team2_id'] == winning_team_id else match['team2_id']
-    update_elo(winning_team_id, losing_team_id)
-    supabase_client.table('matches').update({'completed': True, 'winner_id': winning_team_id}).eq('id', match['id']).execute()
+    if match[0]['completed'] and not glicko_enabled():
+        from replay import recompute_ratings
+        update_ranking(await run_sync(recompute_ratings, db_client, match_number))
+        await interaction.followup.send(f"Match {match_number} has been deleted and ratings have been recomputed.")
+    else:
+        await interaction.followup.send(f"Match {match_number} has been deleted.")
 
-    await interaction.followup.send(f"Team {winning_team_number} has been declared the winner for Match {match_number}, congrats!")
+@bot.tree.command(name="leaderboard", description="Show the players with the highest ELO.")
+@measure("leaderboard")
+async def leaderboard(interaction: discord.Interaction, page: int = 1):
+    """
+    Show the players with the highest ELO, ten per page.
+    Parameters
+    ----------
+    interaction : discord.Interaction
+        The interaction object.
+    page : int
+        The page of the leaderboard to show.
+    """
+    page = max(page, 1)
+    players = await get_leaderboard((page - 1) * LEADERBOARD_PAGE_SIZE, LEADERBOARD_PAGE_SIZE)
+    if not players:
+        await interaction.response.send_message("No ranked players on this page.")
+        return
+
+    members = await resolve_members(interaction.guild, [player['id'] for player in players])
+    pages = -(-ranked_players() // LEADERBOARD_PAGE_SIZE)
+    embed = discord.Embed(title="Leaderboard", color=discord.Color.gold())
+    embed.description = "\n".join(
+        f"**#{player['rank']}** {describe_member(members[player['id']], player['id'])} - {player['elo']} ELO ({player['games_played']} games)"
+        for player in players
+    )
+    embed.set_footer(text=f"Page {page} of {pages}")
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name="rank", description="Show a player's ELO and rank.")
+@measure("rank")
+async def rank(interaction: discord.Interaction, player: discord.Member = None):
+    """
+    Show a player's ELO and rank.
+    Parameters
+    ----------
+    interaction : discord.Interaction
+        The interaction object.
+    player : discord.Member
+        The player to look up, yourself by default.
+    """
+    player = player or interaction.user
+    standing = await get_rank(player.id)
+    if standing is None:
+        await interaction.response.send_message(f"{player.mention} has not played a ranked game yet.")
+        return
+    await interaction.response.send_message(
+        f"{player.mention} is ranked **#{standing['rank']}** of {standing['players']} "
+        f"with {standing['elo']} ELO after {standing['games_played']} games."
+    )
 
-def run_bot():
+@bot.tree.command(name="stats", description="Show latency and I/O statistics for each command.")
+async def stats(interaction: discord.Interaction, raw: bool = False):
+    """
+    Show latency and I/O statistics for each command since the bot started.
+    Parameters
+    ----------
+    interaction : discord.Interaction
+        The interaction object.
+    raw : bool
+        Attach every histogram in the Prometheus text format instead.
+    """
+    if not await has_planner_role_interaction(interaction): return
+    if raw:
+        file = discord.File(io.BytesIO(prometheus_text().encode()), filename="metrics.txt")
+        await interaction.response.send_message(file=file, ephemeral=True)
+        return
+
+    rows = summary()
+    if not rows:
+        await interaction.response.send_message("No commands have run yet.", ephemeral=True)
+        return
+    lines = [f"{'handler':22} {'calls':>5} {'mean':>7} {'p95':>7} {'db':>5} {'db ms':>6} {'rest':>5}"]
+    for row in rows:
+        p95 = f"<{row['p95_seconds'] * 1000:.0f}ms" if row['p95_seconds'] != float('inf') else ">10s"
+        lines.append(f"{row['name'][:22]:22} {row['count']:5} {row['mean_seconds'] * 1000:5.0f}ms {p95:>7} "
+                     f"{row['mean_db_calls']:5.1f} {row['mean_db_seconds'] * 1000:6.0f} {row['mean_rest_calls']:5.1f}")
+    embed = discord.Embed(title="Command Statistics", description="```\n" + "\n".join(lines)[:4000] + "\n```", color=discord.Color.blue())
+    embed.set_footer(text="db and rest are round trips per call, db ms is time waiting on the database per call")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+def _warm_up_database():
+    start = time.perf_counter()
+    try:
+        get_client()
+    except Exception as error:
+        # on_ready tries again, and reports the error if it still fails
+        print(f"Failed to create the database client: {error}")
+    record_startup('create database client', time.perf_counter() - start)
+
+
+def run_bot(measure_startup: bool = False):
+    """
+    Connects to Discord. The database client is created on another thread in the meantime,
+    so it is ready by the time on_ready needs it.
+    :param measure_startup: Print how long each startup step took once ready, then exit.
+    :return: None
+    """
+    global MEASURE_STARTUP, _login_started
+    MEASURE_STARTUP = measure_startup
+    _login_started = time.perf_counter()
+    threading.Thread(target=_warm_up_database, name='database-warm-up', daemon=True).start()
     bot.run(TOKEN)
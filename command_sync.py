@@ -0,0 +1,140 @@
+"""
+Keeps track of the slash commands last synced to Discord, so the bot only syncs when they changed.
+
+The hash of each synced scope (global, or a guild id) is saved to COMMAND_STATE_PATH,
+.command_tree.json by default. Only scopes synced before, ex. guilds synced with !sync, are synced again.
+Point COMMAND_STATE_PATH at a persistent volume when running in a container. Without a state file,
+the commands registered in each scope are fetched from Discord and compared instead.
+"""
+import hashlib
+import json
+import os
+
+import discord
+from discord import app_commands
+
+GLOBAL_SCOPE = 'global'
+# Fields of a command payload that Discord sends back from fetch_commands()
+COMPARED_KEYS = ('name', 'type', 'description', 'options', 'required', 'choices', 'value', 'channel_types',
+                 'min_value', 'max_value', 'min_length', 'max_length', 'autocomplete')
+
+
+def _state_path() -> str:
+    # Read when needed, so a path set in .env is seen after load_dotenv()
+    return os.environ.get('COMMAND_STATE_PATH', '.command_tree.json')
+
+
+def command_tree_hash(tree: app_commands.CommandTree, guild: discord.abc.Snowflake | None = None) -> str:
+    """
+    Hashes the payload Discord receives when syncing a scope, so any change to a command's
+    name, description, parameters or choices changes the hash.
+    :param tree: The command tree.
+    :param guild: The guild, or None for the global commands.
+    :return: The hash, as hex.
+    """
+    payload = sorted((command.to_dict() for command in tree.get_commands(guild=guild)), key=lambda command: command['name'])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _comparable(payload):
+    # Keeps what both a local command's and a fetched command's to_dict() have, without unset values
+    if isinstance(payload, list):
+        return [_comparable(item) for item in payload]
+    if isinstance(payload, dict):
+        return {key: _comparable(value) for key, value in payload.items()
+                if key in COMPARED_KEYS and value is not None and value is not False and value != [] and value != {}}
+    return payload
+
+
+async def registered_commands_match(tree: app_commands.CommandTree, guild: discord.abc.Snowflake | None = None) -> bool | None:
+    """
+    Compares the commands registered with Discord for a scope to the local ones.
+    :param tree: The command tree.
+    :param guild: The guild, or None for the global commands.
+    :return: True if they match, False if they differ, None if the scope has no commands registered.
+    """
+    registered = await tree.fetch_commands(guild=guild)
+    if not registered:
+        return None
+    local = sorted((command.to_dict() for command in tree.get_commands(guild=guild)), key=lambda command: command['name'])
+    remote = sorted((command.to_dict() for command in registered), key=lambda command: command['name'])
+    return _comparable(local) == _comparable(remote)
+
+
+def load_state() -> dict[str, str]:
+    """
+    :return: Dictionary of scope to the hash of the commands last synced to it.
+    """
+    try:
+        with open(_state_path()) as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_state(state: dict[str, str]):
+    # Write then rename, so a crash mid-write never leaves a half written file
+    path = _state_path()
+    with open(path + '.tmp', 'w') as file:
+        json.dump(state, file, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+async def sync_scope(tree: app_commands.CommandTree, guild: discord.abc.Snowflake | None = None):
+    """
+    Syncs one scope and remembers what was synced.
+    :param tree: The command tree.
+    :param guild: The guild, or None for the global commands.
+    :return: None
+    """
+    await tree.sync(guild=guild)
+    state = load_state()
+    state[str(guild.id) if guild else GLOBAL_SCOPE] = command_tree_hash(tree, guild)
+    save_state(state)
+
+
+def forget_scopes(*guilds: discord.abc.Snowflake | None):
+    """
+    Forgets scopes whose commands were cleared, so they are synced again on the next start.
+    :param guilds: The guilds, or None for the global commands.
+    :return: None
+    """
+    state = load_state()
+    for guild in guilds:
+        state.pop(str(guild.id) if guild else GLOBAL_SCOPE, None)
+    save_state(state)
+
+
+async def sync_changed_scopes(tree: app_commands.CommandTree, guilds: list[discord.abc.Snowflake]) -> list[str]:
+    """
+    Syncs the scopes that were synced before and whose commands changed since.
+    Scopes that were never synced, or were cleared, are left alone, and unchanged ones make no request.
+    Without a state file, ex. in a new container, the global scope and every guild the bot is in are
+    checked against the commands registered with Discord, and the state is rebuilt from them.
+    :param tree: The command tree.
+    :param guilds: The guilds the bot is in.
+    :return: The scopes that were synced.
+    """
+    state = load_state()
+    fetch = not state
+    scopes = list(state) if state else [GLOBAL_SCOPE] + [str(guild.id) for guild in guilds]
+    synced = []
+    for scope in scopes:
+        guild = None if scope == GLOBAL_SCOPE else discord.Object(id=int(scope))
+        if guild:
+            # Guild commands are copies of the global ones, made by !sync
+            tree.copy_global_to(guild=guild)
+        if fetch:
+            matches = await registered_commands_match(tree, guild)
+            if matches is None:
+                continue
+            if matches:
+                state[scope] = command_tree_hash(tree, guild)
+                save_state(state)
+                continue
+        elif state[scope] == command_tree_hash(tree, guild):
+            continue
+        await sync_scope(tree, guild)
+        state = load_state()
+        synced.append(scope)
+    return synced
@@ -0,0 +1,265 @@
+import random
+import time
+from bisect import bisect_left
+
+# Seconds spent searching for a better split before settling on the best one found
+BALANCE_TIME_BUDGET = 0.2
+
+
+class _Split:
+    """
+    A split of units (a group, or a single player) into teams.
+
+    Attributes:
+        unit_sums (list[int]): The total elo of each unit.
+        unit_sizes (list[int]): The number of players in each unit.
+        teams (list[list[int]]): The indices of the units in each team.
+        sums (list[int]): The total elo of each team.
+        sizes (list[int]): The number of players in each team.
+        min_size (int): The fewest players a team should have.
+        max_size (int): The most players a team should have.
+    """
+
+    def __init__(self, unit_sums: list[int], unit_sizes: list[int], num_teams: int):
+        self.unit_sums = unit_sums
+        self.unit_sizes = unit_sizes
+        self.teams = [[] for _ in range(num_teams)]
+        self.sums = [0] * num_teams
+        self.sizes = [0] * num_teams
+        players = sum(unit_sizes)
+        self.min_size = players // num_teams
+        self.max_size = -(-players // num_teams)
+        self.mean = sum(unit_sums) / players if players else 0.0
+
+    def add(self, team: int, unit: int):
+        self.teams[team].append(unit)
+        self.sums[team] += self.unit_sums[unit]
+        self.sizes[team] += self.unit_sizes[unit]
+
+    def remove(self, team: int, unit: int):
+        self.teams[team].remove(unit)
+        self.sums[team] -= self.unit_sums[unit]
+        self.sizes[team] -= self.unit_sizes[unit]
+
+    def violation(self, size: int) -> int:
+        """
+        How far a team size is from the allowed sizes.
+        :param size: The number of players in a team.
+        :return: 0 if the size is allowed, otherwise the number of players too many or too few.
+        """
+        return max(0, self.min_size - size, size - self.max_size)
+
+    def score(self) -> tuple[float, float]:
+        """
+        The spread between the highest and lowest team average, then the sum of squared
+        distances of the team averages from the overall average to break ties, so smaller is better.
+        :return: The score of the split.
+        """
+        averages = [total / size for total, size in zip(self.sums, self.sizes) if size]
+        if not averages:
+            return 0.0, 0.0
+        return max(averages) - min(averages), sum((average - self.mean) ** 2 for average in averages)
+
+    def copy_teams(self) -> list[list[int]]:
+        return [list(team) for team in self.teams]
+
+    def restore(self, teams: list[list[int]]):
+        self.teams = [list(team) for team in teams]
+        self.sums = [sum(self.unit_sums[unit] for unit in team) for team in self.teams]
+        self.sizes = [sum(self.unit_sizes[unit] for unit in team) for team in self.teams]
+
+
+def _seed(split: _Split):
+    """
+    Places groups largest first, then single players in rounds from strongest to weakest:
+    each round hands one player to every team with room, the strongest to the team
+    furthest below the average. Teams are compared by how far their elo total is from
+    the average for their size, so a team one player short doesn't look weak.
+    """
+    num_teams = len(split.teams)
+    players = sum(split.unit_sizes)
+    mean = split.mean
+    # Only this many teams can end up with max_size players
+    big_teams = players - num_teams * split.min_size if split.min_size < split.max_size else num_teams
+
+    def deviation(team):
+        return split.sums[team] - mean * split.sizes[team]
+
+    units = sorted(range(len(split.unit_sums)), key=lambda unit: (split.unit_sizes[unit], split.unit_sums[unit] / split.unit_sizes[unit]), reverse=True)
+    singles = [unit for unit in units if split.unit_sizes[unit] == 1]
+    for unit in units:
+        size = split.unit_sizes[unit]
+        if size == 1:
+            continue
+        teams = [team for team in range(num_teams) if split.sizes[team] + size <= split.max_size]
+        if not teams:
+            # The group is too big to fit anywhere, put it where it overflows the least
+            teams = [min(range(num_teams), key=lambda team: split.sizes[team])]
+        split.add(min(teams, key=deviation), unit)
+
+    position = 0
+    while position < len(singles):
+        bigs = sum(1 for size in split.sizes if size >= split.max_size)
+        short = [team for team in range(num_teams) if split.sizes[team] < split.min_size]
+        growing = sorted((team for team in range(num_teams) if split.min_size <= split.sizes[team] < split.max_size), key=deviation)
+        teams = sorted(short + growing[:max(0, big_teams - bigs)], key=deviation)
+        if not teams:
+            teams = [min(range(num_teams), key=lambda team: split.sizes[team])]
+        for team, unit in zip(teams, singles[position:position + len(teams)]):
+            split.add(team, unit)
+        position += len(teams)
+
+
+def _improving_move(split: _Split) -> bool:
+    """
+    Looks for the best swap of two units, or move of one unit, between the strongest or
+    weakest team and another team that keeps team sizes allowed and improves the score.
+    Teams furthest from the extreme team are tried first, stopping at the first one with
+    an improving move. For each unit of the extreme team only the few units of the other
+    team closest to the ideal swap are tried, found by bisecting them sorted by elo.
+    :return: True if a move was applied.
+    """
+    num_teams = len(split.teams)
+    unit_sums = split.unit_sums
+    unit_sizes = split.unit_sizes
+    mean = split.mean
+    averages = [total / size if size else None for total, size in zip(split.sums, split.sizes)]
+    filled = sorted((team for team in range(num_teams) if averages[team] is not None), key=lambda team: averages[team])
+    if len(filled) < 2:
+        return False
+    spread, squares = split.score()
+    best = (spread - 1e-9, squares - 1e-9)
+    best_move = None
+
+    for x in (filled[-1], filled[0]):
+        if best_move is not None:
+            break
+        for y in sorted(range(num_teams), key=lambda team: -abs((averages[team] if averages[team] is not None else averages[x]) - averages[x])):
+            if y == x:
+                continue
+            if best_move is not None:
+                break
+            # Only the extremes of the teams the move doesn't touch matter for the spread
+            others = [averages[team] for team in filled[:3] + filled[-3:] if team not in (x, y)]
+            others_max = max(others, default=float('-inf'))
+            others_min = min(others, default=float('inf'))
+            sum_x, sum_y = split.sums[x], split.sums[y]
+            size_x, size_y = split.sizes[x], split.sizes[y]
+            old_violation = split.violation(size_x) + split.violation(size_y)
+            base_squares = squares - sum((averages[team] - mean) ** 2 for team in (x, y) if averages[team] is not None)
+            # The units of y by size, sorted by elo, plus moving a unit without a swap
+            by_size = {}
+            for v in split.teams[y]:
+                by_size.setdefault(unit_sizes[v], []).append((unit_sums[v], v))
+            candidates_by_size = {size: sorted(rows) for size, rows in by_size.items()}
+
+            for u in split.teams[x]:
+                for v_size, candidates in list(candidates_by_size.items()) + [(0, None)]:
+                    moved_size = unit_sizes[u] - v_size
+                    new_size_x = size_x - moved_size
+                    new_size_y = size_y + moved_size
+                    if moved_size and split.violation(new_size_x) + split.violation(new_size_y) > old_violation:
+                        continue
+                    if candidates is None:
+                        options = [(None, 0)]
+                    else:
+                        # The swap that gives both teams the same average moves this much elo from x to y
+                        ideal = (sum_x * new_size_y - sum_y * new_size_x) / (new_size_x + new_size_y) if new_size_x + new_size_y else 0
+                        i = bisect_left(candidates, (unit_sums[u] - ideal,))
+                        options = [(v, v_sum) for v_sum, v in candidates[max(0, i - 2):i + 2]]
+                    for v, v_sum in options:
+                        moved_sum = unit_sums[u] - v_sum
+                        high, low, new_squares = others_max, others_min, base_squares
+                        for total, size in ((sum_x - moved_sum, new_size_x), (sum_y + moved_sum, new_size_y)):
+                            if size:
+                                average = total / size
+                                high = max(high, average)
+                                low = min(low, average)
+                                new_squares += (average - mean) ** 2
+                        score = (high - low, new_squares)
+                        if score[0] < best[0] or (score[0] <= best[0] + 2e-9 and score[1] < best[1]):
+                            best = score
+                            best_move = (x, y, u, v)
+
+    if best_move is None:
+        return False
+    x, y, u, v = best_move
+    split.remove(x, u)
+    split.add(y, u)
+    if v is not None:
+        split.remove(y, v)
+        split.add(x, v)
+    return True
+
+
+def _perturb(split: _Split, swaps: int):
+    """
+    Makes random swaps between random teams that keep team sizes, to escape a local optimum.
+    A unit is swapped with a unit of the same size, or a group with as many single players,
+    which is the only way groups change teams once single swaps stop helping.
+    :param swaps: The number of swaps to make.
+    """
+    for _ in range(swaps):
+        x, y = random.sample(range(len(split.teams)), 2)
+        if not split.teams[x] or not split.teams[y]:
+            continue
+        u = random.choice(split.teams[x])
+        size = split.unit_sizes[u]
+        same_size = [v for v in split.teams[y] if split.unit_sizes[v] == size]
+        singles = [v for v in split.teams[y] if split.unit_sizes[v] == 1]
+        if size > 1 and len(singles) >= size and (not same_size or random.random() < 0.5):
+            swapped = random.sample(singles, size)
+        elif same_size:
+            swapped = [random.choice(same_size)]
+        else:
+            continue
+        split.remove(x, u)
+        split.add(y, u)
+        for v in swapped:
+            split.remove(y, v)
+            split.add(x, v)
+
+
+def balance_teams(units: list[list[int]], elos: dict[int, int], num_teams: int,
+                  time_budget: float = BALANCE_TIME_BUDGET) -> tuple[list[list[int]], float]:
+    """
+    Splits players into teams with team average elos as close as possible.
+    Groups always stay together and team sizes differ by at most one player
+    (unless a group is too big to allow it). Starts from groups placed first and single
+    players dealt in rounds, and improves it with swaps and moves between teams until no
+    swap helps. While time remains it restarts from the best split with random swaps,
+    making more of them each time a restart fails to improve on it.
+
+    :param units: The groups to keep together. A player without a group is a group of one.
+    :param elos: Dictionary of user id to their elo.
+    :param num_teams: The number of teams to create.
+    :param time_budget: Seconds to spend searching.
+    :return: The teams as lists of user ids, and the spread between the highest and
+    lowest team average elo.
+    """
+    deadline = time.perf_counter() + time_budget
+    units = [unit for unit in units if unit]
+    split = _Split([sum(elos[user_id] for user_id in unit) for unit in units], [len(unit) for unit in units], num_teams)
+    _seed(split)
+
+    best_teams = split.copy_teams()
+    best_score = split.score()
+    strength = 1
+    while time.perf_counter() < deadline:
+        while time.perf_counter() < deadline and _improving_move(split):
+            pass
+        score = split.score()
+        if score < best_score:
+            best_teams = split.copy_teams()
+            best_score = score
+            strength = 1
+        else:
+            split.restore(best_teams)
+            # Shake the best split harder each time it fails to improve, up to a quarter of the units
+            strength = min(strength * 2, max(1, len(units) // 4))
+        if num_teams < 2 or best_score[0] == 0:
+            break
+        _perturb(split, strength)
+
+    teams = [[user_id for unit in team for user_id in units[unit]] for team in best_teams]
+    return teams, best_score[0]
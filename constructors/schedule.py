@@ -0,0 +1,111 @@
+"""
+Builds a night's match schedule from the session's teams, as lists of rounds of
+(team number, team number) pairs in the order they are played.
+"""
+
+
+def round_robin(team_numbers: list[int]) -> list[list[tuple[int, int]]]:
+    """
+    Every team plays every other team once, using the circle method: one team stays
+    in place and the others rotate around it, so each round pairs every team once.
+    With an odd number of teams one team sits out each round.
+    :param team_numbers: The teams, in seeding order.
+    :return: The rounds of matches.
+    """
+    teams = list(team_numbers)
+    if len(teams) % 2:
+        teams.append(None)
+    rounds = []
+    for _ in range(len(teams) - 1):
+        pairs = [(teams[i], teams[-1 - i]) for i in range(len(teams) // 2)]
+        rounds.append([pair for pair in pairs if None not in pair])
+        teams = [teams[0], teams[-1]] + teams[1:-1]
+    return rounds
+
+
+def order_for_rest(rounds: list[list[tuple[int, int]]]) -> list[list[tuple[int, int]]]:
+    """
+    Orders the matches within each round so teams get as many matches of rest as possible
+    between games, picking next the match whose teams have waited the longest.
+    :param rounds: The rounds of matches.
+    :return: The same rounds, with each round reordered.
+    """
+    last_played = {}
+    played = 0
+    ordered = []
+    for matches in rounds:
+        remaining = list(matches)
+        ordered_round = []
+        while remaining:
+            # Longest rest of the less rested team first, then the other team's rest
+            match = max(remaining, key=lambda pair: sorted(played - last_played.get(team, -len(matches)) for team in pair))
+            remaining.remove(match)
+            ordered_round.append(match)
+            for team in match:
+                last_played[team] = played
+            played += 1
+        ordered.append(ordered_round)
+    return ordered
+
+
+def king_of_the_court(team_numbers: list[int], games: int = 0) -> list[list[tuple[int, int]]]:
+    """
+    One court with a line of challengers. The first two teams start on court, and after
+    each match the team that has been on court longer rotates to the back of the line
+    and the next team steps in. Rotation does not depend on results, so the schedule can be
+    made up front, and every team plays back to back exactly once per turn on court.
+    :param team_numbers: The teams, in the order they line up.
+    :param games: The number of matches, by default enough for every team to play twice.
+    :return: One round per match.
+    """
+    if len(team_numbers) < 2:
+        return []
+    games = games or len(team_numbers)
+    court = [team_numbers[0], team_numbers[1]]
+    line = list(team_numbers[2:])
+    rounds = []
+    for _ in range(games):
+        rounds.append([(court[0], court[1])])
+        if line:
+            line.append(court.pop(0))
+            court.append(line.pop(0))
+        else:
+            court.reverse()
+    return rounds
+
+
+def single_elimination(team_numbers: list[int]) -> tuple[list[tuple[int, int]], list[list[tuple[str, str]]]]:
+    """
+    Seeds a bracket with the best seed against the worst. When the number of teams is not
+    a power of two, the top seeds get a bye to the second round.
+    Only the first round's teams are known up front.
+    :param team_numbers: The teams, best seed first.
+    :return: The first round's matches, and the later rounds as labels of where each team comes from.
+    """
+    size = 1
+    while size < len(team_numbers):
+        size *= 2
+    seeds = [1]
+    while len(seeds) < size:
+        # Standard bracket order, so the top two seeds can only meet in the final
+        seeds = [seed for pair in ((seed, 2 * len(seeds) + 1 - seed) for seed in seeds) for seed in pair]
+    slots = [team_numbers[seed - 1] if seed <= len(team_numbers) else None for seed in seeds]
+
+    first_round, labels, match_number = [], [], 0
+    for i in range(0, size, 2):
+        if slots[i] is not None and slots[i + 1] is not None:
+            match_number += 1
+            first_round.append((slots[i], slots[i + 1]))
+            labels.append(f"Winner of game {match_number}")
+        else:
+            labels.append(f"Team {slots[i] if slots[i] is not None else slots[i + 1]}")
+
+    later_rounds = []
+    while len(labels) > 1:
+        pairs = [(labels[i], labels[i + 1]) for i in range(0, len(labels), 2)]
+        later_rounds.append(pairs)
+        labels = []
+        for pair in pairs:
+            match_number += 1
+            labels.append(f"Winner of game {match_number}")
+    return first_round, later_rounds
@@ -1,15 +1,49 @@
+import asyncio
 import random
 
-from db.supabase import get_supabase_client
-
+from constructors.balancer import BALANCE_TIME_BUDGET, balance_teams
+from db.repository import run_query
+from db.storage import get_client
+from event.rosters import invalidate_teams
+
+
+async def get_user_groups(session_id: int) -> dict[int, int]:
+    """
+    Fetches the group members of this session only, by joining on player_groups.session_id.
+    :param session_id: The ID of the session.
+    :return: Dictionary of user id to the id of their group.
+    """
+    db_client = get_client()
+    group_members = await run_query(db_client.table('player_group_members').select('group_id, user_id, player_groups!inner(session_id)').eq('player_groups.session_id', session_id).order('group_id'))
+    user_groups = {}
+    for group_member in group_members:
+        # A player in several groups stays with the first one
+        user_groups.setdefault(group_member['user_id'], group_member['group_id'])
+    return user_groups
+
+def group_players(user_ids: list[int], user_groups: dict[int, int]) -> tuple[dict[int, list[int]], list[int]]:
+    """
+    Splits players into their groups and the players without a group.
+    :param user_ids: The players, in RSVP order.
+    :param user_groups: Dictionary of user id to the id of their group.
+    :return: Dictionary of group id to its players, and the list of individual players.
+    """
+    grouped_players = {}
+    individual_players = []
+    for user_id in user_ids:
+        if user_id in user_groups:
+            grouped_players.setdefault(user_groups[user_id], []).append(user_id)
+        else:
+            individual_players.append(user_id)
+    return grouped_players, individual_players
 
-def form_teams(session_id: int, num_teams: int):
-    supabase_client = get_supabase_client()
+async def form_teams(session_id: int, num_teams: int):
+    db_client = get_client()
     # Get all RSVPs for the session
-    rsvps = supabase_client.table('rsvps').select('*').eq('session_id', session_id).eq('status', 'confirmed').order('order_position').execute().data
+    rsvps = await run_query(db_client.table('rsvps').select('*').eq('session_id', session_id).eq('status', 'confirmed').order('order_position'))
 
     # Get all existing users
-    existing_users = supabase_client.table('users').select('id').execute().data
+    existing_users = await run_query(db_client.table('users').select('id'))
     existing_user_ids = set(user['id'] for user in existing_users)
 
     # Check and add new users
@@ -19,27 +53,11 @@ def form_teams(session_id: int, num_teams: int):
             new_users.append({'id': rsvp['user_id']})  # Default ELO of 1000
 
     if new_users:
-        supabase_client.table('users').insert(new_users).execute()
-
-    # Get all groups for the session
-    groups = supabase_client.table('player_groups').select('*').eq('session_id', session_id).execute().data
-    group_members = supabase_client.table('player_group_members').select('*').execute().data
+        await run_query(db_client.table('users').insert(new_users))
 
     # Organize players into groups and individuals
-    grouped_players = {}
-    individual_players = []
-    for rsvp in rsvps:
-        user_id = rsvp['user_id']
-        is_grouped = False
-        for group in groups:
-            if any(gm['group_id'] == group['id'] and gm['user_id'] == user_id for gm in group_members):
-                if group['id'] not in grouped_players:
-                    grouped_players[group['id']] = []
-                grouped_players[group['id']].append(user_id)
-                is_grouped = True
-                break
-        if not is_grouped:
-            individual_players.append(user_id)
+    user_groups = await get_user_groups(session_id)
+    grouped_players, individual_players = group_players([rsvp['user_id'] for rsvp in rsvps], user_groups)
 
     # Distribute groups and individuals among teams
     teams = [[] for _ in range(num_teams)]
@@ -57,16 +75,16 @@ def form_teams(session_id: int, num_teams: int):
 
     return teams
 
-def form_balanced_teams(session_id: int, num_teams: int):
+async def form_balanced_teams(session_id: int, num_teams: int, time_budget: float = BALANCE_TIME_BUDGET):
     DEFAULT_ELO = 1200
-    supabase_client = get_supabase_client()
+    db_client = get_client()
 
     # Get all RSVPs for the session
-    rsvps = supabase_client.table('rsvps').select('user_id').eq('session_id', session_id).eq('status', 'confirmed').order('order_position').execute().data
+    rsvps = await run_query(db_client.table('rsvps').select('user_id').eq('session_id', session_id).eq('status', 'confirmed').order('order_position'))
     rsvp_user_ids = [rsvp['user_id'] for rsvp in rsvps]
 
         # Get all existing users
-    existing_users = supabase_client.table('users').select('id').execute().data
+    existing_users = await run_query(db_client.table('users').select('id'))
     existing_user_ids = set(user['id'] for user in existing_users)
 
     # Check and add new users
@@ -76,47 +94,59 @@ def form_balanced_teams(session_id: int, num_teams: int):
             new_users.append({'id': rsvp['user_id']})  # Default ELO of 1000
 
     if new_users:
-        supabase_client.table('users').insert(new_users).execute()
+        await run_query(db_client.table('users').insert(new_users))
 
     # Get ELO ratings for all RSVP'd users
-    users = supabase_client.table('users').select('id, elo').in_('id', rsvp_user_ids).execute().data
+    users = await run_query(db_client.table('users').select('id, elo').in_('id', rsvp_user_ids))
     user_elos = {user['id']: user['elo'] for user in users}
 
-    # Get all groups for the session
-    groups = supabase_client.table('player_groups').select('*').eq('session_id', session_id).execute().data
-    group_members = supabase_client.table('player_group_members').select('*').execute().data
-
     # Organize players into groups and individuals
-    grouped_players = {}
-    individual_players = []
-    for rsvp_user_id in rsvp_user_ids:
-        is_grouped = False
-        for group in groups:
-            if any(gm['group_id'] == group['id'] and gm['user_id'] == rsvp_user_id for gm in group_members):
-                if group['id'] not in grouped_players:
-                    grouped_players[group['id']] = []
-                grouped_players[group['id']].append(rsvp_user_id)
-                is_grouped = True
-                break
-        if not is_grouped:
-            individual_players.append(rsvp_user_id)
-
-    # Sort individual players by ELO
-    individual_players.sort(key=lambda user_id: user_elos.get(user_id, DEFAULT_ELO), reverse=True)
-
-    # Distribute groups and individuals among teams
-    teams = [[] for _ in range(num_teams)]
-
-    # First, distribute grouped players
-    for _, players in grouped_players.items():
-        team_index = min(range(num_teams), key=lambda i: sum(user_elos.get(user_id, DEFAULT_ELO) for user_id in teams[i]))
-        teams[team_index].extend(players)
-
-    # Then, distribute individual players
-    team_elo_sums = [sum(user_elos.get(user_id, DEFAULT_ELO) for user_id in team) for team in teams]
-    for user_id in individual_players:
-        team_index = team_elo_sums.index(min(team_elo_sums))
-        teams[team_index].append(user_id)
-        team_elo_sums[team_index] += user_elos.get(user_id, DEFAULT_ELO)
-
-    return teams
+    user_groups = await get_user_groups(session_id)
+    grouped_players, individual_players = group_players(rsvp_user_ids, user_groups)
+
+    # Search for the split with the closest team averages, keeping groups together.
+    # The search runs in a thread so the event loop keeps serving other interactions.
+    elos = {user_id: user_elos.get(user_id, DEFAULT_ELO) for user_id in rsvp_user_ids}
+    units = list(grouped_players.values()) + [[user_id] for user_id in individual_players]
+    return await asyncio.to_thread(balance_teams, units, elos, num_teams, time_budget)
+
+async def has_completed_matches(session_id: int) -> bool:
+    """
+    Teams can't be re-formed once a match was played, since the match's result is rated against its rosters.
+    :param session_id: The ID of the session.
+    :return: True if the session has a completed match.
+    """
+    db_client = get_client()
+    matches = await run_query(db_client.table('matches').select('id').eq('session_id', session_id).eq('completed', True).limit(1))
+    return bool(matches)
+
+async def save_teams(session_id: int, teams: list[list[int]]):
+    """
+    Replaces the session's teams and clears its open matches.
+    :param session_id: The ID of the session.
+    :param teams: The user ids of each team's players, in team number order.
+    :return: None
+    """
+    if await has_completed_matches(session_id):
+        raise ValueError(f"Session {session_id} already has completed matches")
+    db_client = get_client()
+
+    # Clear the session's previous teams, their members and their open matches
+    old_teams = await run_query(db_client.table('teams').select('id').eq('session_id', session_id))
+    old_team_ids = [team['id'] for team in old_teams]
+    await asyncio.gather(
+        run_query(db_client.table('team_members').delete().in_('team_id', old_team_ids)),
+        run_query(db_client.table('matches').delete().eq('session_id', session_id).neq('completed', True)),
+    )
+    await run_query(db_client.table('teams').delete().eq('session_id', session_id))
+
+    # Store every team in one insert, then every team member in one insert
+    team_rows = await run_query(db_client.table('teams').insert([
+        {'session_id': session_id, 'team_number': i} for i in range(1, len(teams) + 1)
+    ]))
+    team_ids = {team['team_number']: team['id'] for team in team_rows}
+    member_rows = [{'team_id': team_ids[i], 'user_id': player}
+                   for i, team in enumerate(teams, start=1) for player in team]
+    if member_rows:
+        await run_query(db_client.table('team_members').insert(member_rows))
+    invalidate_teams(session_id)
@@ -38,7 +38,11 @@ CREATE TABLE team_members (
 CREATE TABLE users (
     id BIGINT PRIMARY KEY,
     -- discord_id BIGINT UNIQUE NOT NULL,
-    elo INTEGER DEFAULT 1000
+    elo INTEGER DEFAULT 1000,
+    games_played INTEGER DEFAULT 0,
+    -- Only used with RATING_SYSTEM=glicko2
+    rating_deviation REAL DEFAULT 350,
+    volatility REAL DEFAULT 0.06
 );
 
 -- Create matches table
@@ -47,7 +51,8 @@ CREATE TABLE matches (
     session_id INTEGER REFERENCES sessions(id),
     team1_id INTEGER REFERENCES teams(id),
     team2_id INTEGER REFERENCES teams(id),
-    winner_id INTEGER REFERENCES teams(id)
+    winner_id INTEGER REFERENCES teams(id),
+    completed BOOLEAN DEFAULT FALSE
 );
 
 -- Create player groups table
@@ -67,8 +72,31 @@ CREATE TABLE player_group_members (
 CREATE INDEX idx_rsvps_session_id ON rsvps(session_id);
 CREATE INDEX idx_rsvps_user_id ON rsvps(user_id);
 CREATE INDEX idx_rsvps_session_order ON rsvps(session_id, order_position);
+CREATE INDEX idx_rsvps_session_status_order ON rsvps(session_id, status, order_position);
 CREATE INDEX idx_teams_session_id ON teams(session_id);
 CREATE INDEX idx_team_members_team_id ON team_members(team_id);
 CREATE INDEX idx_team_members_user_id ON team_members(user_id);
-CREATE INDEX idx_users_discord_id ON users(discord_id);
 CREATE INDEX idx_matches_session_id ON matches(session_id);
+
+-- Create rating history table, one row per player per rated match
+CREATE TABLE rating_history (
+    id SERIAL PRIMARY KEY,
+    match_id INTEGER NOT NULL,
+    user_id BIGINT NOT NULL,
+    elo_before INTEGER NOT NULL,
+    elo_after INTEGER NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Create rating checkpoints table, every rated player's rating after match_id
+CREATE TABLE rating_checkpoints (
+    id SERIAL PRIMARY KEY,
+    match_id INTEGER NOT NULL,
+    user_id BIGINT NOT NULL,
+    elo INTEGER NOT NULL,
+    games_played INTEGER NOT NULL
+);
+
+CREATE INDEX idx_rating_history_match_id ON rating_history(match_id);
+CREATE INDEX idx_rating_history_user_id ON rating_history(user_id);
+CREATE INDEX idx_rating_checkpoints_match_id ON rating_checkpoints(match_id);
@@ -0,0 +1,114 @@
+-- Adds a user to the RSVP list of the session posted as the given message.
+-- The session row is locked, so concurrent RSVPs for a session are admitted one at a time.
+-- Returns the new RSVP's status, or no row if there is no open session or the user already RSVP'd.
+CREATE OR REPLACE FUNCTION rsvp_add(p_rsvp_message_id BIGINT, p_user_id BIGINT)
+RETURNS TABLE (rsvp_status TEXT) AS $$
+DECLARE
+    v_session_id INTEGER;
+    v_max_players INTEGER;
+    v_status TEXT;
+BEGIN
+    SELECT id, max_players INTO v_session_id, v_max_players
+    FROM sessions
+    WHERE rsvp_message_id = p_rsvp_message_id AND completed IS NOT TRUE
+    FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    IF EXISTS (SELECT 1 FROM rsvps WHERE session_id = v_session_id AND user_id = p_user_id) THEN
+        RETURN;
+    END IF;
+
+    SELECT CASE WHEN count(*) < v_max_players THEN 'confirmed' ELSE 'waitlist' END INTO v_status
+    FROM rsvps
+    WHERE session_id = v_session_id AND status = 'confirmed';
+
+    INSERT INTO rsvps (session_id, user_id, status, order_position)
+    SELECT v_session_id, p_user_id, v_status, COALESCE(MAX(order_position), 0) + 1
+    FROM rsvps
+    WHERE session_id = v_session_id;
+
+    rsvp_status := v_status;
+    RETURN NEXT;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Removes a user from the RSVP list of the session posted as the given message,
+-- promoting the first waitlisted user if a confirmed spot opened up.
+-- order_position only has to keep the RSVPs in order, so the gap left behind is never
+-- renumbered and a cancellation costs the same few writes however big the session is.
+-- Returns the removed RSVP's status, or no row if nothing was removed.
+CREATE OR REPLACE FUNCTION rsvp_remove(p_rsvp_message_id BIGINT, p_user_id BIGINT)
+RETURNS TABLE (rsvp_status TEXT) AS $$
+DECLARE
+    v_session_id INTEGER;
+    v_status TEXT;
+BEGIN
+    SELECT id INTO v_session_id
+    FROM sessions
+    WHERE rsvp_message_id = p_rsvp_message_id AND completed IS NOT TRUE
+    FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    -- /add-players can leave a user with several RSVPs, all removed together.
+    -- 'confirmed' sorts before 'waitlist', so min() is confirmed if any removed RSVP was.
+    WITH removed AS (
+        DELETE FROM rsvps
+        WHERE session_id = v_session_id AND user_id = p_user_id
+        RETURNING status
+    )
+    SELECT min(status) INTO v_status FROM removed;
+    IF v_status IS NULL THEN
+        RETURN;
+    END IF;
+
+    IF v_status = 'confirmed' THEN
+        UPDATE rsvps SET status = 'confirmed'
+        WHERE id = (
+            SELECT id FROM rsvps
+            WHERE session_id = v_session_id AND status = 'waitlist'
+            ORDER BY order_position
+            LIMIT 1
+        );
+    END IF;
+
+    rsvp_status := v_status;
+    RETURN NEXT;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Saves match results and the ratings they lead to in one transaction: marks the matches
+-- completed with their winners, writes the players' new elo and games_played, and appends
+-- their rating_history rows. p_users and p_history are empty when the ratings are not
+-- updated here (Glicko-2, or a replay after an out of order result).
+-- Raises, writing nothing, if a match does not exist or already has a result.
+CREATE OR REPLACE FUNCTION save_results(p_matches JSONB, p_users JSONB, p_history JSONB)
+RETURNS TABLE (saved_matches INTEGER) AS $$
+DECLARE
+    v_saved INTEGER;
+BEGIN
+    UPDATE matches m
+    SET winner_id = r.winner_id, completed = TRUE
+    FROM jsonb_to_recordset(p_matches) AS r(id INTEGER, winner_id INTEGER)
+    WHERE m.id = r.id AND m.completed IS NOT TRUE;
+    GET DIAGNOSTICS v_saved = ROW_COUNT;
+    IF v_saved <> jsonb_array_length(p_matches) THEN
+        RAISE EXCEPTION 'A match does not exist or already has a result';
+    END IF;
+
+    INSERT INTO users (id, elo, games_played)
+    SELECT r.id, r.elo, r.games_played
+    FROM jsonb_to_recordset(p_users) AS r(id BIGINT, elo INTEGER, games_played INTEGER)
+    ON CONFLICT (id) DO UPDATE SET elo = EXCLUDED.elo, games_played = EXCLUDED.games_played;
+
+    INSERT INTO rating_history (match_id, user_id, elo_before, elo_after)
+    SELECT r.match_id, r.user_id, r.elo_before, r.elo_after
+    FROM jsonb_to_recordset(p_history) AS r(match_id INTEGER, user_id BIGINT, elo_before INTEGER, elo_after INTEGER);
+
+    saved_matches := v_saved;
+    RETURN NEXT;
+END;
+$$ LANGUAGE plpgsql;
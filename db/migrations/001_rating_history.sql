@@ -0,0 +1,25 @@
+-- Adds the rating history and checkpoint tables to a database created before they were in
+-- db/create_tables.sql. Safe to run more than once.
+
+-- Create rating history table, one row per player per rated match
+CREATE TABLE IF NOT EXISTS rating_history (
+    id SERIAL PRIMARY KEY,
+    match_id INTEGER NOT NULL,
+    user_id BIGINT NOT NULL,
+    elo_before INTEGER NOT NULL,
+    elo_after INTEGER NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Create rating checkpoints table, every rated player's rating after match_id
+CREATE TABLE IF NOT EXISTS rating_checkpoints (
+    id SERIAL PRIMARY KEY,
+    match_id INTEGER NOT NULL,
+    user_id BIGINT NOT NULL,
+    elo INTEGER NOT NULL,
+    games_played INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_rating_history_match_id ON rating_history(match_id);
+CREATE INDEX IF NOT EXISTS idx_rating_history_user_id ON rating_history(user_id);
+CREATE INDEX IF NOT EXISTS idx_rating_checkpoints_match_id ON rating_checkpoints(match_id);
@@ -0,0 +1,5 @@
+-- Adds the Glicko-2 columns (RATING_SYSTEM=glicko2) to a users table created before they were
+-- in db/create_tables.sql. saves/load_file.py reads and writes them in both modes.
+-- Safe to run more than once.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS rating_deviation REAL DEFAULT 350;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS volatility REAL DEFAULT 0.06;
@@ -0,0 +1,100 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from metrics import record_db_call
+
+# The storage clients' query builders are synchronous, so queries run on a small worker pool
+# instead of on the discord.py event loop.
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+PAGE_SIZE = 1000  # PostgREST returns at most 1000 rows per request
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """
+    Returns the query worker pool, creating it on first use so SUPABASE_MAX_WORKERS can
+    come from .env. Keep it at or below the HTTP pool size.
+    :return: The worker pool.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                load_dotenv()
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(os.environ.get('SUPABASE_MAX_WORKERS', 8)),
+                    thread_name_prefix='supabase',
+                )
+    return _executor
+
+
+async def run_query(query):
+    """
+    Executes a storage query builder without blocking the event loop.
+    Independent queries can be awaited together with asyncio.gather().
+    :param query: A built query, ex. client.table('sessions').select('*')
+    :return: The rows returned by the query.
+    """
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    response = await loop.run_in_executor(_get_executor(), query.execute)
+    record_db_call(time.perf_counter() - start)
+    return response.data
+
+
+async def run_sync(func, *args):
+    """
+    Runs a blocking function that talks to the database on the query worker pool.
+    It runs in a copy of the caller's context, so each query it makes through execute()
+    or fetch_all() counts as one round trip of the handler that awaited it.
+    :param func: The function to run.
+    :param args: The arguments passed to the function.
+    :return: Whatever the function returns.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_get_executor(), context.run, func, *args)
+
+
+def execute(query):
+    """
+    Executes a storage query builder on the calling thread, for blocking code run with run_sync().
+    :param query: A built query, ex. client.table('sessions').select('*')
+    :return: The query's response.
+    """
+    start = time.perf_counter()
+    response = query.execute()
+    record_db_call(time.perf_counter() - start)
+    return response
+
+
+def fetch_pages(query_factory, page_size: int = PAGE_SIZE):
+    """
+    Reads a query one page at a time, without holding more than one page.
+    :param query_factory: Function returning a fresh, ordered query builder.
+    :param page_size: The number of rows per request, at most PAGE_SIZE.
+    :return: Generator of the pages, each a list of rows.
+    """
+    offset = 0
+    while True:
+        page = execute(query_factory().range(offset, offset + page_size - 1)).data
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        offset += len(page)
+
+
+def fetch_all(query_factory) -> list[dict]:
+    """
+    Reads every row of a query, one page at a time.
+    :param query_factory: Function returning a fresh, ordered query builder.
+    :return: All the rows of the query.
+    """
+    return [row for page in fetch_pages(query_factory) for row in page]
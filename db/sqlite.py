@@ -0,0 +1,407 @@
+"""
+An embedded SQLite backend with the same query builder interface as the Supabase client.
+
+The tables come from db/create_tables.sql, and the functions in db/functions.sql are
+implemented in Python below, so the rest of the bot runs unchanged on a local file.
+"""
+import os
+import re
+import sqlite3
+import threading
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'create_tables.sql')
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _quote(identifier: str) -> str:
+    if not re.fullmatch(r'\w+', identifier):
+        raise ValueError(f"Invalid identifier: {identifier!r}")
+    return f'"{identifier}"'
+
+
+def _split_columns(columns: str) -> list[str]:
+    # Splits "id, name, rsvps(user_id, status)" on the commas outside of brackets
+    parts, depth, current = [], 0, ''
+    for char in columns:
+        if char == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+            continue
+        depth += char == '('
+        depth -= char == ')'
+        current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def translate_schema(schema: str) -> str:
+    """
+    Rewrites the Postgres schema into SQLite's dialect.
+    :param schema: The contents of db/create_tables.sql.
+    :return: The same schema for SQLite.
+    """
+    schema = re.sub(r'--.*', '', schema)
+    schema = schema.replace('SERIAL PRIMARY KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT')
+    schema = schema.replace('TIMESTAMP WITH TIME ZONE', 'TIMESTAMP')
+    return re.sub(r'ALTER TABLE (\w+) ADD CONSTRAINT (\w+) UNIQUE \(([^)]*)\)',
+                  r'CREATE UNIQUE INDEX \2 ON \1(\3)', schema)
+
+
+class SQLiteResponse:
+    def __init__(self, data):
+        self.data = data
+        self.count = None
+
+
+class SQLiteClient:
+    """
+    A SQLite database that answers the same queries as the Supabase client.
+
+    Attributes:
+        path (str): The database file, or ':memory:'.
+        calls (int): The number of queries executed so far.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.calls = 0
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        if path != ':memory:':
+            self.connection.execute('PRAGMA journal_mode = WAL')
+        # Queries arrive from the query worker pool, SQLite handles them one at a time
+        self.lock = threading.RLock()
+        self._columns = {}
+        self._relations = {}
+        if not self.connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sessions'").fetchone():
+            with open(SCHEMA_PATH) as file:
+                self.connection.executescript(translate_schema(file.read()))
+
+    def table(self, name: str) -> 'SQLiteQuery':
+        return SQLiteQuery(self, name)
+
+    def from_(self, name: str) -> 'SQLiteQuery':
+        return self.table(name)
+
+    def rpc(self, name: str, params: dict) -> 'SQLiteFunctionCall':
+        return SQLiteFunctionCall(self, name, params)
+
+    def columns(self, table: str) -> dict[str, str]:
+        """
+        :param table: The name of a table.
+        :return: Dictionary of the table's column names to their declared types.
+        """
+        if table not in self._columns:
+            rows = self.connection.execute(f'PRAGMA table_info({_quote(table)})').fetchall()
+            self._columns[table] = {row['name']: row['type'].upper() for row in rows}
+        return self._columns[table]
+
+    def relation(self, table: str, other: str) -> tuple[str, str, bool]:
+        """
+        Finds the foreign key joining two tables, like PostgREST does for embedding.
+        :param table: The table being selected.
+        :param other: The embedded table.
+        :return: The joining column in table, the joining column in other, and True if
+        each row of table has at most one row of other.
+        """
+        key = (table, other)
+        if key not in self._relations:
+            for row in self.connection.execute(f'PRAGMA foreign_key_list({_quote(table)})'):
+                if row['table'] == other:
+                    self._relations[key] = (row['from'], row['to'] or 'id', True)
+            for row in self.connection.execute(f'PRAGMA foreign_key_list({_quote(other)})'):
+                if row['table'] == table and key not in self._relations:
+                    self._relations[key] = (row['to'] or 'id', row['from'], False)
+            if key not in self._relations:
+                raise ValueError(f"No relationship between {table} and {other}")
+        return self._relations[key]
+
+    def to_dict(self, table: str, row: sqlite3.Row) -> dict:
+        # SQLite has no booleans, give them back as True/False like Postgres does
+        types = self.columns(table)
+        return {column: bool(row[column]) if types.get(column) == 'BOOLEAN' and row[column] is not None else row[column]
+                for column in row.keys()}
+
+
+class SQLiteQuery:
+    def __init__(self, client: SQLiteClient, table: str):
+        self.client = client
+        self.table = table
+        self.action = 'select'
+        self.columns = '*'
+        self.values = None
+        self.filters = []
+        self.ordering = []
+        self.limit_count = None
+        self.offset = 0
+
+    def select(self, *columns):
+        self.action = 'select'
+        self.columns = ','.join(columns) if columns else '*'
+        return self
+
+    def insert(self, values):
+        self.action, self.values = 'insert', values
+        return self
+
+    def upsert(self, values):
+        self.action, self.values = 'upsert', values
+        return self
+
+    def update(self, values):
+        self.action, self.values = 'update', values
+        return self
+
+    def delete(self):
+        self.action = 'delete'
+        return self
+
+    def _filter(self, column, operator, value):
+        self.filters.append((column, operator, value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, '=', value)
+
+    def neq(self, column, value):
+        return self._filter(column, '!=', value)
+
+    def gt(self, column, value):
+        return self._filter(column, '>', value)
+
+    def gte(self, column, value):
+        return self._filter(column, '>=', value)
+
+    def lt(self, column, value):
+        return self._filter(column, '<', value)
+
+    def lte(self, column, value):
+        return self._filter(column, '<=', value)
+
+    def in_(self, column, values):
+        return self._filter(column, 'IN', list(values))
+
+    def order(self, column, *, desc=False):
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def range(self, start, end):
+        self.offset, self.limit_count = start, end - start + 1
+        return self
+
+    def execute(self) -> SQLiteResponse:
+        with self.client.lock:
+            self.client.calls += 1
+            if self.action == 'select':
+                return SQLiteResponse(self._select())
+            return SQLiteResponse(self._write())
+
+    @staticmethod
+    def _where(filters, alias: str) -> tuple[list[str], list]:
+        clauses, params = [], []
+        for column, operator, value in filters:
+            column = f'{alias}.{_quote(column)}'
+            if operator == 'IN':
+                clauses.append(f"{column} IN ({', '.join('?' * len(value))})")
+                params.extend(value)
+            elif value is None:
+                clauses.append(f"{column} IS {'NOT ' if operator == '!=' else ''}NULL")
+            else:
+                clauses.append(f'{column} {operator} ?')
+                params.append(value)
+        return clauses, params
+
+    def _embeds(self) -> tuple[list[str], dict[str, tuple[list[str], bool]]]:
+        columns, embeds = [], {}
+        for column in _split_columns(self.columns):
+            match = re.fullmatch(r'(\w+)(!inner)?\((.*)\)', column)
+            if match:
+                embeds[match.group(1)] = (_split_columns(match.group(3)), bool(match.group(2)))
+            else:
+                columns.append(column)
+        return columns, embeds
+
+    def _select(self) -> list[dict]:
+        columns, embeds = self._embeds()
+        own_filters = [condition for condition in self.filters if '.' not in condition[0]]
+        embed_filters = {name: [] for name in embeds}
+        for column, operator, value in self.filters:
+            if '.' in column:
+                name, column = column.split('.', 1)
+                embed_filters.setdefault(name, []).append((column, operator, value))
+
+        clauses, params = self._where(own_filters, 't')
+        for name, (_, inner) in embeds.items():
+            if inner:
+                # Like PostgREST's !inner, only keep rows with a matching embedded row
+                column, other_column, _ = self.client.relation(self.table, name)
+                embed_clauses, embed_params = self._where(embed_filters[name], 'e')
+                condition = ' AND '.join([f't.{_quote(column)} = e.{_quote(other_column)}'] + embed_clauses)
+                clauses.append(f'EXISTS (SELECT 1 FROM {_quote(name)} e WHERE {condition})')
+                params.extend(embed_params)
+
+        # Embedding needs the joining columns, they are dropped again if not selected
+        wanted = [column for column in columns if column != '*']
+        joins = [self.client.relation(self.table, name)[0] for name in embeds]
+        if '*' in columns or not wanted:
+            selected = 't.*'
+        else:
+            selected = ', '.join(f't.{_quote(column)}' for column in dict.fromkeys(wanted + joins))
+        sql = f'SELECT {selected} FROM {_quote(self.table)} t'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        if self.ordering:
+            sql += ' ORDER BY ' + ', '.join(f't.{_quote(column)}{" DESC" if desc else ""}' for column, desc in self.ordering)
+        if self.limit_count is not None or self.offset:
+            sql += ' LIMIT ? OFFSET ?'
+            params.extend([self.limit_count if self.limit_count is not None else -1, self.offset])
+
+        rows = [self.client.to_dict(self.table, row) for row in self.client.connection.execute(sql, params)]
+        for name, (embed_columns, _) in embeds.items():
+            self._attach(rows, name, embed_columns, embed_filters[name])
+        if wanted and '*' not in columns:
+            keep = set(wanted) | set(embeds)
+            rows = [{column: value for column, value in row.items() if column in keep} for row in rows]
+        return rows
+
+    def _attach(self, rows: list[dict], name: str, columns: list[str], filters: list):
+        # Fetches the embedded rows of every selected row in one query
+        column, other_column, to_one = self.client.relation(self.table, name)
+        keys = list({row[column] for row in rows if row[column] is not None})
+        clauses, params = self._where(filters + [(other_column, 'IN', keys)], 'e')
+        related = {}
+        for other in self.client.connection.execute(f'SELECT * FROM {_quote(name)} e WHERE {" AND ".join(clauses)}', params):
+            other = self.client.to_dict(name, other)
+            related.setdefault(other[other_column], []).append(
+                other if '*' in columns else {key: other[key] for key in columns})
+        for row in rows:
+            matches = related.get(row[column], [])
+            row[name] = (matches[0] if matches else None) if to_one else matches
+
+    def _write(self) -> list[dict]:
+        connection = self.client.connection
+        table = _quote(self.table)
+        if self.action == 'update':
+            clauses, params = self._where(self.filters, table)
+            assignments = ', '.join(f'{_quote(column)} = ?' for column in self.values)
+            sql = f'UPDATE {table} SET {assignments}' + (' WHERE ' + ' AND '.join(clauses) if clauses else '') + ' RETURNING *'
+            return [self.client.to_dict(self.table, row) for row in connection.execute(sql, list(self.values.values()) + params)]
+        if self.action == 'delete':
+            clauses, params = self._where(self.filters, table)
+            sql = f'DELETE FROM {table}' + (' WHERE ' + ' AND '.join(clauses) if clauses else '') + ' RETURNING *'
+            return [self.client.to_dict(self.table, row) for row in connection.execute(sql, params)]
+
+        values = self.values if isinstance(self.values, list) else [self.values]
+        rows = []
+        connection.execute('BEGIN')
+        try:
+            for value in values:
+                columns = ', '.join(_quote(column) for column in value)
+                sql = f"INSERT INTO {table} ({columns}) VALUES ({', '.join('?' * len(value))})"
+                if self.action == 'upsert':
+                    updates = ', '.join(f'{_quote(column)} = excluded.{_quote(column)}' for column in value if column != 'id')
+                    sql += f' ON CONFLICT (id) DO UPDATE SET {updates}' if updates else ' ON CONFLICT (id) DO NOTHING'
+                rows.extend(connection.execute(sql + ' RETURNING *', list(value.values())).fetchall())
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return [self.client.to_dict(self.table, row) for row in rows]
+
+
+class SQLiteFunctionCall:
+    def __init__(self, client: SQLiteClient, name: str, params: dict):
+        self.client = client
+        self.name = name
+        self.params = params
+
+    def execute(self) -> SQLiteResponse:
+        connection = self.client.connection
+        with self.client.lock:
+            self.client.calls += 1
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                result = FUNCTIONS[self.name](connection, **self.params)
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+        return SQLiteResponse(result)
+
+
+def _rsvp_add(connection: sqlite3.Connection, p_rsvp_message_id: int, p_user_id: int) -> list[dict]:
+    # Same as rsvp_add in db/functions.sql
+    session = connection.execute('SELECT id, max_players FROM sessions WHERE rsvp_message_id = ? AND completed IS NOT TRUE',
+                                 (p_rsvp_message_id,)).fetchone()
+    if session is None:
+        return []
+    if connection.execute('SELECT 1 FROM rsvps WHERE session_id = ? AND user_id = ?', (session['id'], p_user_id)).fetchone():
+        return []
+    confirmed = connection.execute("SELECT count(*) FROM rsvps WHERE session_id = ? AND status = 'confirmed'", (session['id'],)).fetchone()[0]
+    status = 'confirmed' if confirmed < session['max_players'] else 'waitlist'
+    connection.execute('INSERT INTO rsvps (session_id, user_id, status, order_position) '
+                       'SELECT ?, ?, ?, COALESCE(MAX(order_position), 0) + 1 FROM rsvps WHERE session_id = ?',
+                       (session['id'], p_user_id, status, session['id']))
+    return [{'rsvp_status': status}]
+
+
+def _rsvp_remove(connection: sqlite3.Connection, p_rsvp_message_id: int, p_user_id: int) -> list[dict]:
+    # Same as rsvp_remove in db/functions.sql
+    session = connection.execute('SELECT id FROM sessions WHERE rsvp_message_id = ? AND completed IS NOT TRUE',
+                                 (p_rsvp_message_id,)).fetchone()
+    if session is None:
+        return []
+    removed = connection.execute('DELETE FROM rsvps WHERE session_id = ? AND user_id = ? RETURNING status',
+                                 (session['id'], p_user_id)).fetchall()
+    if not removed:
+        return []
+    status = min(row['status'] for row in removed)
+    if status == 'confirmed':
+        connection.execute("UPDATE rsvps SET status = 'confirmed' WHERE id = ("
+                           "SELECT id FROM rsvps WHERE session_id = ? AND status = 'waitlist' ORDER BY order_position LIMIT 1)",
+                           (session['id'],))
+    return [{'rsvp_status': status}]
+
+
+def _save_results(connection: sqlite3.Connection, p_matches: list[dict], p_users: list[dict], p_history: list[dict]) -> list[dict]:
+    # Same as save_results in db/functions.sql
+    for match in p_matches:
+        saved = connection.execute('UPDATE matches SET winner_id = ?, completed = TRUE WHERE id = ? AND completed IS NOT TRUE',
+                                   (match['winner_id'], match['id']))
+        if saved.rowcount != 1:
+            raise ValueError("A match does not exist or already has a result")
+    connection.executemany('INSERT INTO users (id, elo, games_played) VALUES (?, ?, ?) '
+                           'ON CONFLICT (id) DO UPDATE SET elo = excluded.elo, games_played = excluded.games_played',
+                           [(user['id'], user['elo'], user['games_played']) for user in p_users])
+    connection.executemany('INSERT INTO rating_history (match_id, user_id, elo_before, elo_after) VALUES (?, ?, ?, ?)',
+                           [(row['match_id'], row['user_id'], row['elo_before'], row['elo_after']) for row in p_history])
+    return [{'saved_matches': len(p_matches)}]
+
+
+FUNCTIONS = {
+    'rsvp_add': _rsvp_add,
+    'rsvp_remove': _rsvp_remove,
+    'save_results': _save_results,
+}
+
+
+def get_sqlite_client() -> SQLiteClient:
+    """
+    Returns the process-wide SQLite client, creating the database file and its tables on first use.
+    The file is SQLITE_PATH, volleybot.db by default.
+    :return: The shared SQLite client.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SQLiteClient(os.environ.get('SQLITE_PATH', 'volleybot.db'))
+    return _client
@@ -0,0 +1,62 @@
+"""
+Picks the database the bot stores its data in.
+
+Every backend exposes the part of the Supabase client the bot uses: table(name) with
+select (including embedded tables), insert, upsert, update, delete, the eq, neq, in_,
+order, limit and range filters and execute(), plus rpc(name, params).execute() for the
+functions in db/functions.sql. Responses carry their rows in .data.
+
+STORAGE_BACKEND chooses the implementation:
+    supabase: The hosted Supabase project (default).
+    sqlite: A local SQLite file (SQLITE_PATH, volleybot.db by default) built from db/create_tables.sql.
+"""
+import os
+
+from dotenv import load_dotenv
+
+BACKENDS = ('supabase', 'sqlite')
+
+_backend: str | None = None
+
+
+def storage_backend() -> str:
+    """
+    Reads STORAGE_BACKEND from the environment the first time it is needed.
+    :return: The name of the backend in use.
+    """
+    global _backend
+    if _backend is None:
+        load_dotenv()
+        backend = os.environ.get('STORAGE_BACKEND', 'supabase').lower()
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}, expected one of {', '.join(BACKENDS)}")
+        _backend = backend
+    return _backend
+
+
+def get_client():
+    """
+    Returns the shared client of the configured backend.
+    :return: A Supabase client or a SQLite client, both answering the same queries.
+    """
+    if storage_backend() == 'sqlite':
+        from db.sqlite import get_sqlite_client
+        return get_sqlite_client()
+    from db.supabase import get_supabase_client
+    return get_supabase_client()
+
+
+def check_storage_health() -> bool:
+    """
+    Checks that the configured backend answers queries.
+    :return: True if the database answered, False otherwise.
+    """
+    if storage_backend() == 'sqlite':
+        try:
+            get_client().table('sessions').select('id').limit(1).execute()
+            return True
+        except Exception as error:
+            print(f"SQLite health check failed: {error}")
+            return False
+    from db.supabase import check_supabase_health
+    return check_supabase_health()
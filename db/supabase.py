@@ -1,10 +1,86 @@
-from supabase import create_client, Client
-from dotenv import load_dotenv
 import os
+import threading
+
+import httpx
+from dotenv import load_dotenv
+from postgrest.utils import SyncClient
+from supabase import create_client, Client
+
+_client: Client | None = None
+_client_lock = threading.Lock()
+
+
+def _pool_limits() -> httpx.Limits:
+    """
+    Reads the HTTP connection pool limits from the environment.
+    SUPABASE_MAX_CONNECTIONS: Maximum number of open connections.
+    SUPABASE_MAX_KEEPALIVE: Maximum number of idle keep-alive connections.
+    SUPABASE_KEEPALIVE_EXPIRY: Seconds an idle connection is kept open.
+    :return: The httpx pool limits.
+    """
+    return httpx.Limits(
+        max_connections=int(os.environ.get('SUPABASE_MAX_CONNECTIONS', 20)),
+        max_keepalive_connections=int(os.environ.get('SUPABASE_MAX_KEEPALIVE', 10)),
+        keepalive_expiry=float(os.environ.get('SUPABASE_KEEPALIVE_EXPIRY', 60)),
+    )
 
-def get_supabase_client():
+
+def _create_pooled_client() -> Client:
     load_dotenv()
     SUPABASE_URL = os.environ.get('SUPABASE_URL')
     SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
     supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+    # Swap the PostgREST session for one with our keep-alive pool limits
+    postgrest = supabase.postgrest
+    session = postgrest.session
+    postgrest.session = SyncClient(
+        base_url=session.base_url,
+        headers=session.headers,
+        timeout=session.timeout,
+        limits=_pool_limits(),
+    )
+    session.close()
     return supabase
+
+
+def get_supabase_client() -> Client:
+    """
+    Returns the process-wide Supabase client, creating it on first use.
+    The client holds a pooled keep-alive HTTP session, so every caller shares
+    the same connections instead of doing a new TLS handshake per query.
+    :return: The shared Supabase client.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _create_pooled_client()
+    return _client
+
+
+def reset_supabase_client():
+    """
+    Closes the shared client so the next get_supabase_client() call builds a fresh one.
+    :return: None
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.postgrest.aclose()
+            _client = None
+
+
+def check_supabase_health() -> bool:
+    """
+    Runs a cheap query against Supabase. If it fails the shared client is reset
+    so a broken connection pool is not reused.
+    :return: True if Supabase answered, False otherwise.
+    """
+    try:
+        get_supabase_client().table('sessions').select('id').limit(1).execute()
+        return True
+    except Exception as error:
+        print(f"Supabase health check failed: {error}")
+        reset_supabase_client()
+        return False
@@ -1,6 +1,32 @@
+import asyncio
+import os
 from math import pow
 
-from db.supabase import get_supabase_client
+from dotenv import load_dotenv
+
+from db.repository import run_query
+from db.storage import get_client
+from ranking import update_ranking
+
+# k in Elo's formula. Players are provisional until they pass PROVISIONAL_GAMES games.
+K_FACTOR = 50
+PROVISIONAL_K_FACTOR = 100
+PROVISIONAL_GAMES = 50
+
+# Elo (default), or glicko2 to rate whole sessions with glicko.py
+_rating_system: str | None = None
+
+
+def glicko_enabled() -> bool:
+    """
+    Reads RATING_SYSTEM from the environment the first time it is needed.
+    :return: True if ratings are Glicko-2 rated per session, False for Elo per match (default).
+    """
+    global _rating_system
+    if _rating_system is None:
+        load_dotenv()
+        _rating_system = os.environ.get('RATING_SYSTEM', 'elo').lower()
+    return _rating_system == 'glicko2'
 
 
 def calculate_elo(my_rating: int, their_rating: int, games: int, is_winner: bool) -> int:
@@ -24,7 +50,7 @@ def calculate_elo(my_rating: int, their_rating: int, games: int, is_winner: bool
     easily determine the skill level of any given player. Hence we weight the first 5 games more to
     place them in their appropriate Elo ranking quickly.
     """
-    k = 50 if games > 50 else 100
+    k = K_FACTOR if games > PROVISIONAL_GAMES else PROVISIONAL_K_FACTOR
 
     den = 1 + pow(10, (their_rating - my_rating) / 400)
     estimate = 1 / den
@@ -36,33 +62,86 @@ def calculate_elo(my_rating: int, their_rating: int, games: int, is_winner: bool
         new_rating = my_rating - round(k * estimate)
     return new_rating
 
-def update_elo(winning_id, losing_id):
-    supabase_client = get_supabase_client()
-
-    # Get the winning and losing team members user id's
-    winning_team_members = supabase_client.table('team_members').select('user_id').eq('team_id', winning_id).execute().data
-    losing_team_members = supabase_client.table('team_members').select('user_id').eq('team_id', losing_id).execute().data
-    winning_team_members = [member['user_id'] for member in winning_team_members]
-    losing_team_members = [member['user_id'] for member in losing_team_members]
-
-    # Calcuate average elo of each team
-    winning_team_elo = 0
-    losing_team_elo = 0
-    for member in winning_team_members:
-        user = supabase_client.table('users').select('elo').eq('id', member).execute().data[0]
-        winning_team_elo += user['elo']
-    for member in losing_team_members:
-        user = supabase_client.table('users').select('elo').eq('id', member).execute().data[0]
-        losing_team_elo += user['elo']
-    winning_team_elo = winning_team_elo / len(winning_team_members)
-    losing_team_elo = losing_team_elo / len(losing_team_members)
-
-    # Update elo for each team member
-    for member in winning_team_members:
-        user = supabase_client.table('users').select('elo', 'games_played').eq('id', member).execute().data[0]
+def rate_match(winning_users: list[dict], losing_users: list[dict]) -> list[dict]:
+    """
+    Calculates the new ratings of every player in a match, in memory.
+    Each Player is rated against the average rating of the other Team.
+
+    :param winning_users: The winning Team's users rows (id, elo, games_played)
+    :param losing_users: The losing Team's users rows (id, elo, games_played)
+    :return: The updated users rows, ready to be written back in one upsert.
+    """
+    winning_team_elo = sum(user['elo'] for user in winning_users) / len(winning_users)
+    losing_team_elo = sum(user['elo'] for user in losing_users) / len(losing_users)
+
+    updated_users = []
+    for user in winning_users:
         new_elo = calculate_elo(user['elo'], losing_team_elo, user['games_played'], True)
-        supabase_client.table('users').update({'elo': new_elo, 'games_played': user['games_played'] + 1}).eq('id', member).execute()
-    for member in losing_team_members:
-        user = supabase_client.table('users').select('elo', 'games_played').eq('id', member).execute().data[0]
+        updated_users.append({'id': user['id'], 'elo': new_elo, 'games_played': user['games_played'] + 1})
+    for user in losing_users:
         new_elo = calculate_elo(user['elo'], winning_team_elo, user['games_played'], False)
-        supabase_client.table('users').update({'elo': new_elo, 'games_played': user['games_played'] + 1}).eq('id', member).execute()
\ No newline at end of file
+        updated_users.append({'id': user['id'], 'elo': new_elo, 'games_played': user['games_played'] + 1})
+    return updated_users
+
+def rate_matches(matches: list[dict], rosters: dict[int, list[int]], users: dict[int, dict]) -> tuple[list[dict], list[dict]]:
+    """
+    Applies rate_match() to several matches in the order they were played, in memory.
+    Players without a users row are left out.
+
+    :param matches: The matches (id, team1_id, team2_id, winner_id), in the order they were played.
+    :param rosters: Dictionary of team id to its players' user ids.
+    :param users: Dictionary of user id to their users row (id, elo, games_played). Updated in place.
+    :return: The final users row of every rated player, and a rating_history row per player per match.
+    """
+    rated_users, history = {}, []
+    for match in matches:
+        losing_id = match['team1_id'] if match['team2_id'] == match['winner_id'] else match['team2_id']
+        winning_users = [users[user_id] for user_id in dict.fromkeys(rosters.get(match['winner_id'], [])) if user_id in users]
+        losing_users = [users[user_id] for user_id in dict.fromkeys(rosters.get(losing_id, [])) if user_id in users]
+        if not winning_users or not losing_users:
+            continue
+        for user in rate_match(winning_users, losing_users):
+            history.append({'match_id': match['id'], 'user_id': user['id'], 'elo_before': users[user['id']]['elo'], 'elo_after': user['elo']})
+            users[user['id']] = rated_users[user['id']] = user
+    return list(rated_users.values()), history
+
+async def write_results(matches: list[dict], users: list[dict] = (), history: list[dict] = ()):
+    """
+    Marks matches completed with their winners and writes the new ratings and their history,
+    all in one transaction (save_results in db/functions.sql), so a failure writes nothing.
+    Raises if a match does not exist or already has a result.
+    :param matches: The matches (id, winner_id).
+    :param users: The users rows (id, elo, games_played) to write.
+    :param history: The rating_history rows to add.
+    :return: None
+    """
+    await run_query(get_client().rpc('save_results', {
+        'p_matches': [{'id': match['id'], 'winner_id': match['winner_id']} for match in matches],
+        'p_users': list(users),
+        'p_history': list(history),
+    }))
+
+async def rate_results(matches: list[dict]) -> list[dict]:
+    """
+    Saves the results of matches and rates them in the order they were played, reading every
+    roster and rating once and writing the results, ratings and history in one transaction.
+    :param matches: The matches (id, team1_id, team2_id, winner_id), in the order they were played.
+    :return: The users rows that were written.
+    """
+    db_client = get_client()
+
+    # Get every roster at once, then every player's elo at once
+    team_ids = list({team_id for match in matches for team_id in (match['team1_id'], match['team2_id'])})
+    team_members = await run_query(db_client.table('team_members').select('team_id, user_id').in_('team_id', team_ids))
+    rosters = {}
+    for member in team_members:
+        rosters.setdefault(member['team_id'], []).append(member['user_id'])
+    member_ids = list({member['user_id'] for member in team_members})
+    users = await run_query(db_client.table('users').select('id, elo, games_played').in_('id', member_ids))
+    users = {user['id']: user for user in users}
+
+    rated_users, history = rate_matches(matches, rosters, users)
+    await write_results(matches, rated_users, history)
+    if rated_users:
+        update_ranking(rated_users)
+    return rated_users
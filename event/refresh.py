@@ -0,0 +1,34 @@
+import asyncio
+
+from event.rsvp import update_rsvp_message
+
+# Reactions within this many seconds of each other share a single embed refresh
+REFRESH_DELAY = 1.5
+
+_pending: dict[int, asyncio.Task] = {}
+_tasks: set[asyncio.Task] = set()
+
+
+def schedule_rsvp_refresh(message):
+    """
+    Schedules a refresh of the RSVP message's embed. Refreshes requested while one is
+    already waiting are coalesced into it, and it renders the latest state when it runs.
+    :param message: The RSVP message to refresh.
+    :return: None
+    """
+    if message.id in _pending:
+        return
+    task = asyncio.create_task(_refresh_later(message))
+    _pending[message.id] = task
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _refresh_later(message):
+    await asyncio.sleep(REFRESH_DELAY)
+    # Reactions arriving while we render schedule a new refresh instead of being lost
+    _pending.pop(message.id, None)
+    try:
+        await update_rsvp_message(message)
+    except Exception as error:
+        print(f"Failed to refresh RSVP message {message.id}: {error}")
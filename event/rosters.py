@@ -0,0 +1,114 @@
+"""
+Read model of each session's teams and groups with their members, for the listing commands.
+
+A session's teams, or groups, are read in one nested select and kept until the next
+write to them, which must call invalidate_teams or invalidate_groups. Each invalidation bumps
+the session's generation, and a read only caches its rows if the generation did not change
+while it was waiting on the database, so a write during the select never leaves stale rows.
+"""
+from collections import OrderedDict
+
+from db.repository import run_query
+from db.storage import get_client
+
+SESSION_CACHE_SIZE = 100
+# Session id to its teams as {'id', 'team_number', 'members'}, in team number order
+_teams: OrderedDict[int, list[dict]] = OrderedDict()
+# Session id to its groups as {'id', 'group_name', 'members'}, in creation order
+_groups: OrderedDict[int, list[dict]] = OrderedDict()
+# Group id to its session id, for writes that only know the group
+_group_sessions: dict[int, int] = {}
+# Session id to the number of times its teams, or groups, were invalidated. The groups of
+# None count the writes to groups whose session was not known.
+_team_generations: dict[int, int] = {}
+_group_generations: dict[int | None, int] = {}
+
+
+def _remember(cache: OrderedDict, session_id: int, rows: list[dict]):
+    cache[session_id] = rows
+    cache.move_to_end(session_id)
+    while len(cache) > SESSION_CACHE_SIZE:
+        _, evicted = cache.popitem(last=False)
+        if cache is _groups:
+            for group in evicted:
+                _group_sessions.pop(group['id'], None)
+
+
+async def get_session_teams(session_id: int) -> list[dict]:
+    """
+    :param session_id: The ID of the session.
+    :return: The session's teams in team number order, each with its id, team_number and members' user ids.
+    """
+    if session_id in _teams:
+        _teams.move_to_end(session_id)
+        return _teams[session_id]
+    generation = _team_generations.get(session_id, 0)
+    db_client = get_client()
+    rows = await run_query(db_client.table('teams').select('id, team_number, team_members(user_id)').eq('session_id', session_id).order('team_number'))
+    teams = [{
+        'id': row['id'],
+        'team_number': row['team_number'],
+        'members': [member['user_id'] for member in row['team_members']],
+    } for row in rows]
+    if _team_generations.get(session_id, 0) == generation:
+        _remember(_teams, session_id, teams)
+    return teams
+
+
+async def get_session_groups(session_id: int) -> list[dict]:
+    """
+    :param session_id: The ID of the session.
+    :return: The session's groups in creation order, each with its id, group_name and members' user ids.
+    """
+    if session_id in _groups:
+        _groups.move_to_end(session_id)
+        return _groups[session_id]
+    generation = (_group_generations.get(session_id, 0), _group_generations.get(None, 0))
+    db_client = get_client()
+    rows = await run_query(db_client.table('player_groups').select('id, group_name, player_group_members(user_id)').eq('session_id', session_id).order('id'))
+    groups = [{
+        'id': row['id'],
+        'group_name': row['group_name'],
+        'members': [member['user_id'] for member in row['player_group_members']],
+    } for row in rows]
+    if (_group_generations.get(session_id, 0), _group_generations.get(None, 0)) == generation:
+        for group in groups:
+            _group_sessions[group['id']] = session_id
+        _remember(_groups, session_id, groups)
+    return groups
+
+
+def invalidate_teams(session_id: int):
+    """
+    Drops a session's cached teams after its teams or team members were written.
+    :param session_id: The ID of the session.
+    :return: None
+    """
+    _teams.pop(session_id, None)
+    _team_generations[session_id] = _team_generations.get(session_id, 0) + 1
+
+
+def invalidate_groups(session_id: int):
+    """
+    Drops a session's cached groups after its groups or group members were written.
+    :param session_id: The ID of the session.
+    :return: None
+    """
+    for group in _groups.pop(session_id, []):
+        _group_sessions.pop(group['id'], None)
+    _group_generations[session_id] = _group_generations.get(session_id, 0) + 1
+
+
+def invalidate_group(group_id: int):
+    """
+    Drops the cached groups of the session a group belongs to, if they are cached.
+    A group whose session is not cached has nothing to drop, but a read of its session
+    may be in flight, so no groups read before this write are cached.
+    :param group_id: The ID of the group.
+    :return: None
+    """
+    session_id = _group_sessions.get(group_id)
+    if session_id is not None:
+        invalidate_groups(session_id)
+    else:
+        _group_generations[None] = _group_generations.get(None, 0) + 1
@@ -1,112 +1,101 @@
-import discord
-from db.supabase import get_supabase_client
+import asyncio
 
-supabase = get_supabase_client()
+import discord
+from db.repository import run_query
+from db.storage import get_client
+from event.sessions import get_active_session
+from helpers import describe_member, resolve_members
+from metrics import measure
+
+# Last embed rendered per RSVP message, so unchanged embeds are not edited again
+_rendered_embeds: dict[int, dict] = {}
+_session_locks: dict[int, asyncio.Lock] = {}
+
+def _session_lock(message_id: int) -> asyncio.Lock:
+    # One lock per RSVP message, so reactions to the same session are handled in order
+    return _session_locks.setdefault(message_id, asyncio.Lock())
+
+def forget_rsvp_message(message_id: int):
+    """
+    Drops the rendered embed and lock of an RSVP message once its session is closed.
+    :param message_id: The id of the RSVP message.
+    :return: None
+    """
+    _rendered_embeds.pop(message_id, None)
+    _session_locks.pop(message_id, None)
 
 async def add_rsvp_db(message, payload):
-    supabase_client = get_supabase_client()
-    session = supabase_client.table('sessions').select('*').eq('rsvp_message_id', message.id).neq('completed', True).execute().data
-
-
-    if not session:
-        return
-
-    session = session[0]
-
-    # Get the current highest order position for this session
-    max_order = supabase_client.table('rsvps').select('order_position').eq('session_id', session['id']).order('order_position', desc=True).limit(1).execute().data
-    new_order = 1 if not max_order else max_order[0]['order_position'] + 1
-
-    current_rsvps = supabase_client.table('rsvps').select('*').eq('session_id', session['id']).eq('status', 'confirmed').execute()
-    current_waitlist = supabase_client.table('rsvps').select('*').eq('session_id', session['id']).eq('status', 'waitlist').execute()
-    current_rsvps_ids = [rsvp['user_id'] for rsvp in current_rsvps.data]
-    current_waitlist_ids = [rsvp['user_id'] for rsvp in current_waitlist.data]
-    if (payload.member.id in current_rsvps_ids) or (payload.member.id in current_waitlist_ids):
-        return
-
-
-    if len(current_rsvps.data) < session['max_players']:
-        status = 'confirmed'
-    else:
-        status = 'waitlist'
-
-    supabase_client.table('rsvps').insert({
-        'session_id': session['id'],
-        'user_id': payload.member.id,
-        'status': status,
-        'order_position': new_order
-    }).execute()
+    """
+    Adds the user to the session's RSVP list, or its waitlist if the session is full.
+    Admission runs in one atomic database call (rsvp_add in db/functions.sql).
+    :return: The new RSVP's status, or None if nothing changed.
+    """
+    db_client = get_client()
+    async with _session_lock(message.id):
+        result = await run_query(db_client.rpc('rsvp_add', {
+            'p_rsvp_message_id': message.id,
+            'p_user_id': payload.member.id
+        }))
+    if not result:
+        return None
+    return result[0]['rsvp_status']
 
 async def remove_rsvp_db(message, payload):
-    supabase_client = get_supabase_client()
-    session = supabase_client.table('sessions').select('*').eq('rsvp_message_id', message.id).neq('completed', True).execute().data
-    print(session)
-    if not session:
-        return
-
-    session = session[0]
-
-    # Remove the RSVP
-    removed_rsvp = supabase_client.table('rsvps').delete().eq('session_id', session['id']).eq('user_id', payload.member.id).execute().data[0]
-
-    if removed_rsvp['status'] == 'confirmed':
-        # Find the first person on the waitlist
-        first_waitlist = supabase_client.table('rsvps').select('*').eq('session_id', session['id']).eq('status', 'waitlist').order('order_position').limit(1).execute().data
-
-        if first_waitlist:
-            # Move the first waitlisted person to confirmed status
-            supabase_client.table('rsvps').update({'status': 'confirmed'}).eq('id', first_waitlist[0]['id']).execute()
-
-    # Reorder the remaining RSVPs
-    all_rsvps = supabase_client.table('rsvps').select('*').eq('session_id', session['id']).order('order_position').execute().data
-
-    for i, rsvp in enumerate(all_rsvps, start=1):
-        supabase_client.table('rsvps').update({'order_position': i}).eq('id', rsvp['id']).execute()
-
+    """
+    Removes the user from the session's RSVP list and promotes the first waitlisted
+    user into their spot. Runs in one atomic database call (rsvp_remove in db/functions.sql).
+    :return: The removed RSVP's status, or None if nothing changed.
+    """
+    db_client = get_client()
+    async with _session_lock(message.id):
+        result = await run_query(db_client.rpc('rsvp_remove', {
+            'p_rsvp_message_id': message.id,
+            'p_user_id': payload.member.id
+        }))
+    if not result:
+        return None
+    return result[0]['rsvp_status']
+
+@measure('rsvp-refresh')
 async def update_rsvp_message(message):
-    supabase_client = get_supabase_client()
-    session = supabase_client.table('sessions').select('location, datetime, max_players, rsvps(user_id, order_position, status)').eq('rsvp_message_id', message.id).neq('completed', True).execute().data
-    print(session)
+    session = get_active_session(message.id)
     if not session:
         return
+    db_client = get_client()
+    # Positions can have gaps after cancellations, only their order matters
+    rsvps = await run_query(db_client.table('rsvps').select('user_id, status').eq('session_id', session['id']).order('order_position'))
     confirmed_ids = []
     waitlist_ids = []
-    for rsvp in session[0]['rsvps']:
+    for rsvp in rsvps:
         if rsvp['status'] == 'confirmed':
             confirmed_ids.append(rsvp['user_id'])
         else:
             waitlist_ids.append(rsvp['user_id'])
-    print("confirmed: ", confirmed_ids)
-    print("waitlist: ", waitlist_ids)
-    # Get all the members to extract their name and/or mention
-    confirmed_members = []
-    waitlist_members = []
-    for id in confirmed_ids:
-        member = await message.guild.fetch_member(id)
-        confirmed_members.append(member)
-    for id in waitlist_ids:
-        member = await message.guild.fetch_member(id)
-        waitlist_members.append(member)
+    # Get the confirmed members to extract their name and mention, the waitlist only needs mentions
+    confirmed_members = await resolve_members(message.guild, confirmed_ids)
 
     event_embed = discord.Embed(
                 title="Volleyball Session", color=0x00ff00
             ).add_field(
                 name="Date",
-                value=session[0]['datetime'],
+                value=session['datetime'],
                 inline=False
             ).add_field(
                 name="Location",
-                value=session[0]['location'],
+                value=session['location'],
                 inline=False
             ).add_field(
                 name="Max Players",
-                value=f"{len(confirmed_ids)}/{session[0]['max_players']}",
+                value=f"{len(confirmed_ids)}/{session['max_players']}",
                 inline=False
             ).add_field(
                 name="RSVP",
-                value="Confirmed:\n" + ', \n'.join(f'{member.name} ({member.mention})' for member in confirmed_members) + "\n\nWaitlist:\n"+ ', '.join(f'<@{player}>' for player in waitlist_ids),
+                value="Confirmed:\n" + ', \n'.join(describe_member(confirmed_members[id], id) for id in confirmed_ids) + "\n\nWaitlist:\n"+ ', '.join(f'<@{player}>' for player in waitlist_ids),
                 inline=False
             ).set_footer(
                 text="React with a ✅ to RSVP. If you can no longer make it react with a ❌ to give up your spot to someone else!"
             )
+    if _rendered_embeds.get(message.id) == event_embed.to_dict():
+        return
     await message.edit(embed=event_embed)
+    _rendered_embeds[message.id] = event_embed.to_dict()
@@ -0,0 +1,58 @@
+from db.repository import run_query
+from db.storage import get_client
+
+# Open sessions by the id of their RSVP message. Each entry holds the session's id,
+# datetime, location and max_players.
+_active_sessions: dict[int, dict] = {}
+
+
+async def load_active_sessions():
+    """
+    Loads every open session that has an RSVP message into the index.
+    :return: None
+    """
+    db_client = get_client()
+    sessions = await run_query(db_client.table('sessions').select('id, datetime, location, max_players, rsvp_message_id').neq('completed', True))
+    _active_sessions.clear()
+    for session in sessions:
+        if session['rsvp_message_id'] is not None:
+            add_active_session(session['rsvp_message_id'], session)
+    print(f"Loaded {len(_active_sessions)} active sessions")
+
+
+def add_active_session(message_id: int, session: dict):
+    """
+    Adds a session to the index.
+    :param message_id: The id of the session's RSVP message.
+    :param session: The sessions row (id, datetime, location, max_players).
+    :return: None
+    """
+    _active_sessions[message_id] = {
+        'id': session['id'],
+        'datetime': session['datetime'],
+        'location': session['location'],
+        'max_players': session['max_players'],
+    }
+
+
+def remove_active_session(session_id: int):
+    """
+    Removes a session from the index once it is ended or deleted.
+    :param session_id: The ID of the session.
+    :return: None
+    """
+    # Imported here, event.rsvp imports this module
+    from event.rsvp import forget_rsvp_message
+    for message_id, session in list(_active_sessions.items()):
+        if session['id'] == session_id:
+            del _active_sessions[message_id]
+            forget_rsvp_message(message_id)
+
+
+def get_active_session(message_id: int) -> dict | None:
+    """
+    Looks up the open session posted as a message, without any I/O.
+    :param message_id: The id of a message.
+    :return: The indexed session, or None if the message is not an open session's RSVP message.
+    """
+    return _active_sessions.get(message_id)
@@ -0,0 +1,169 @@
+"""
+Glicko-2 ratings, updated once per session instead of once per match.
+
+With RATING_SYSTEM=glicko2, /winner only records results and /end-session rates every
+match of the session as one rating period. Each player is rated against the opposing
+team of each of their matches, taken as one opponent with the team's average rating and
+root mean square deviation. users.elo holds the rating, next to rating_deviation and volatility.
+"""
+import asyncio
+
+import numpy as np
+
+from db.repository import run_query
+from db.storage import get_client
+
+SCALE = 173.7178  # Converts between the Glicko and Glicko-2 scales
+DEFAULT_RD = 350.0  # Default of users.rating_deviation
+DEFAULT_VOLATILITY = 0.06  # Default of users.volatility
+TAU = 0.5  # How much volatility can change in one rating period
+EPSILON = 1e-6  # Convergence tolerance of the volatility iteration
+
+def _g(phi: np.ndarray) -> np.ndarray:
+    return 1 / np.sqrt(1 + 3 * phi ** 2 / np.pi ** 2)
+
+
+def _new_volatility(phi: np.ndarray, sigma: np.ndarray, v: np.ndarray, delta: np.ndarray) -> np.ndarray:
+    """
+    Step 5 of Glicko-2, the Illinois iteration, run for every player at once.
+    """
+    a = np.log(sigma ** 2)
+
+    def f(x):
+        ex = np.exp(x)
+        return ex * (delta ** 2 - phi ** 2 - v - ex) / (2 * (phi ** 2 + v + ex) ** 2) - (x - a) / TAU ** 2
+
+    big = delta ** 2 > phi ** 2 + v
+    b = np.where(big, np.log(np.maximum(delta ** 2 - phi ** 2 - v, 1e-300)), a - TAU)
+    k = np.ones_like(a)
+    searching = ~big & (f(b) < 0)
+    while searching.any():
+        k += searching
+        b = np.where(searching, a - k * TAU, b)
+        searching &= f(b) < 0
+
+    low, f_low = a, f(a)
+    high, f_high = b, f(b)
+    active = np.abs(high - low) > EPSILON
+    while active.any():
+        c = low + (low - high) * f_low / (f_high - f_low)
+        f_c = f(c)
+        crossed = f_c * f_high <= 0
+        low, f_low = np.where(active & crossed, high, low), np.where(active & crossed, f_high, np.where(active, f_low / 2, f_low))
+        high, f_high = np.where(active, c, high), np.where(active, f_c, f_high)
+        active &= np.abs(high - low) > EPSILON
+    return np.exp(low / 2)
+
+
+def rate_period(ratings: np.ndarray, deviations: np.ndarray, volatilities: np.ndarray,
+                players: np.ndarray, opponent_ratings: np.ndarray, opponent_deviations: np.ndarray,
+                scores: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Rates one period of results for every player at once.
+    :param ratings: Every player's rating.
+    :param deviations: Every player's rating deviation.
+    :param volatilities: Every player's volatility.
+    :param players: For each result, the index of the player it belongs to.
+    :param opponent_ratings: For each result, the opponent's rating.
+    :param opponent_deviations: For each result, the opponent's rating deviation.
+    :param scores: For each result, 1 for a win and 0 for a loss.
+    :return: The new ratings, deviations and volatilities. Players without results keep theirs.
+    """
+    mu = (ratings - 1500) / SCALE
+    phi = deviations / SCALE
+    g = _g(opponent_deviations / SCALE)
+    expected = 1 / (1 + np.exp(-g * (mu[players] - (opponent_ratings - 1500) / SCALE)))
+
+    size = len(ratings)
+    played = np.bincount(players, minlength=size) > 0
+    information = np.bincount(players, weights=g ** 2 * expected * (1 - expected), minlength=size)
+    improvement = np.bincount(players, weights=g * (scores - expected), minlength=size)
+    v = 1 / np.where(played, information, 1)
+    delta = v * improvement
+
+    new_sigma = volatilities.astype(float).copy()
+    new_sigma[played] = _new_volatility(phi[played], volatilities[played], v[played], delta[played])
+    phi_star = np.sqrt(phi ** 2 + new_sigma ** 2)
+    new_phi = np.where(played, 1 / np.sqrt(1 / phi_star ** 2 + 1 / v), phi)
+    new_mu = np.where(played, mu + new_phi ** 2 * improvement, mu)
+    return new_mu * SCALE + 1500, new_phi * SCALE, new_sigma
+
+
+def rate_session_matches(matches: list[dict], rosters: dict[int, list[int]], users: dict[int, dict]) -> list[dict]:
+    """
+    Rates a session's matches as one Glicko-2 rating period.
+    :param matches: The session's completed matches.
+    :param rosters: Dictionary of team id to its players' user ids.
+    :param users: Dictionary of user id to their users row (elo, games_played, rating_deviation, volatility).
+    :return: The new users rows of every player who played.
+    """
+    player_ids = sorted({user_id for match in matches for team_id in (match['team1_id'], match['team2_id'])
+                         for user_id in rosters.get(team_id, []) if user_id in users})
+    if not player_ids:
+        return []
+    index = {user_id: i for i, user_id in enumerate(player_ids)}
+    ratings = np.array([users[user_id]['elo'] for user_id in player_ids], dtype=float)
+    deviations = np.array([users[user_id].get('rating_deviation') or DEFAULT_RD for user_id in player_ids], dtype=float)
+    volatilities = np.array([users[user_id].get('volatility') or DEFAULT_VOLATILITY for user_id in player_ids], dtype=float)
+
+    players, opponent_ratings, opponent_deviations, scores = [], [], [], []
+    for match in matches:
+        teams = [np.array([index[user_id] for user_id in rosters.get(team_id, []) if user_id in index], dtype=np.int64)
+                 for team_id in (match['team1_id'], match['team2_id'])]
+        if not len(teams[0]) or not len(teams[1]):
+            continue
+        for team, other, team_id in ((teams[0], teams[1], match['team1_id']), (teams[1], teams[0], match['team2_id'])):
+            players.append(team)
+            opponent_ratings.append(np.full(len(team), ratings[other].mean()))
+            opponent_deviations.append(np.full(len(team), np.sqrt((deviations[other] ** 2).mean())))
+            scores.append(np.full(len(team), 1.0 if team_id == match['winner_id'] else 0.0))
+    if not players:
+        return []
+
+    players = np.concatenate(players)
+    new_ratings, new_deviations, new_volatilities = rate_period(
+        ratings, deviations, volatilities, players,
+        np.concatenate(opponent_ratings), np.concatenate(opponent_deviations), np.concatenate(scores),
+    )
+    games = np.bincount(players, minlength=len(player_ids))
+    return [{
+        'id': user_id,
+        'elo': int(round(new_ratings[i])),
+        'games_played': users[user_id]['games_played'] + int(games[i]),
+        'rating_deviation': float(new_deviations[i]),
+        'volatility': float(new_volatilities[i]),
+    } for user_id, i in index.items() if games[i]]
+
+
+async def rate_session(session_id: int) -> list[dict]:
+    """
+    Rates every completed match of a session at once and writes the new ratings in one request.
+    :param session_id: The ID of the session.
+    :return: The users rows that were written.
+    """
+    db_client = get_client()
+    matches = await run_query(db_client.table('matches').select('id, team1_id, team2_id, winner_id').eq('session_id', session_id).eq('completed', True).order('id'))
+    matches = [match for match in matches if match['winner_id'] is not None]
+    if not matches:
+        return []
+    team_ids = list({team_id for match in matches for team_id in (match['team1_id'], match['team2_id'])})
+    team_members = await run_query(db_client.table('team_members').select('team_id, user_id').in_('team_id', team_ids))
+    rosters = {}
+    for member in team_members:
+        rosters.setdefault(member['team_id'], []).append(member['user_id'])
+    member_ids = list({member['user_id'] for member in team_members})
+    users = await run_query(db_client.table('users').select('id, elo, games_played, rating_deviation, volatility').in_('id', member_ids))
+    users = {user['id']: user for user in users}
+
+    rated_users = rate_session_matches(matches, rosters, users)
+    if not rated_users:
+        return []
+    # The whole session is one rating change, recorded against its last match
+    last_match_id = matches[-1]['id']
+    history = [{'match_id': last_match_id, 'user_id': user['id'], 'elo_before': users[user['id']]['elo'], 'elo_after': user['elo']}
+               for user in rated_users]
+    await asyncio.gather(
+        run_query(db_client.table('users').upsert(rated_users)),
+        run_query(db_client.table('rating_history').insert(history)),
+    )
+    return rated_users
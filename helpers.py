@@ -1,4 +1,15 @@
+import asyncio
+import time
+from collections import OrderedDict
+
 import discord
+
+# Members fetched over REST are kept for a while so repeated embeds don't refetch them
+MEMBER_CACHE_TTL = 15 * 60
+MEMBER_CACHE_SIZE = 1000
+_member_cache: OrderedDict[tuple[int, int], tuple[float, discord.Member]] = OrderedDict()
+
+
 def has_planner_role(ctx):
     # Specifically add Planners as the sole role capable of using this command
     role_access = discord.utils.get(ctx.guild.roles, name="Planners")
@@ -17,3 +28,56 @@ async def has_planner_role_interaction(interaction: discord.Interaction):
         print("User does not have permission to run this command.")
         return False
     return True
+
+async def _fetch_member(guild: discord.Guild, user_id: int):
+    try:
+        member = await guild.fetch_member(user_id)
+    except discord.NotFound:
+        return None
+    except discord.HTTPException as error:
+        # One failed fetch must not fail the whole gather, the member is shown as a mention
+        print(f"Failed to fetch member {user_id}: {error}")
+        return None
+    _member_cache[(guild.id, user_id)] = (time.monotonic() + MEMBER_CACHE_TTL, member)
+    _member_cache.move_to_end((guild.id, user_id))
+    while len(_member_cache) > MEMBER_CACHE_SIZE:
+        _member_cache.popitem(last=False)
+    return member
+
+async def resolve_members(guild: discord.Guild, user_ids) -> dict[int, discord.Member | None]:
+    """
+    Resolves user ids to guild members. Uses the gateway member cache first, then
+    members recently fetched over REST, and only fetches the rest, all at once.
+    :param guild: The guild the members belong to.
+    :param user_ids: The user ids to resolve.
+    :return: Dictionary of user id to member, or None if they left the guild or could not be fetched.
+    """
+    members = {}
+    missing = []
+    now = time.monotonic()
+    for user_id in user_ids:
+        member = guild.get_member(user_id)
+        if member is None:
+            cached = _member_cache.get((guild.id, user_id))
+            if cached and cached[0] > now:
+                member = cached[1]
+        if member is None:
+            missing.append(user_id)
+        else:
+            members[user_id] = member
+
+    missing = list(dict.fromkeys(missing))
+    fetched = await asyncio.gather(*(_fetch_member(guild, user_id) for user_id in missing))
+    members.update(zip(missing, fetched))
+    return members
+
+def describe_member(member: discord.Member | None, user_id: int) -> str:
+    """
+    Formats a member as "name (mention)", or just a mention if they left the guild.
+    :param member: The resolved member, or None.
+    :param user_id: The member's user id.
+    :return: The formatted member.
+    """
+    if member is None:
+        return f"<@{user_id}>"
+    return f"{member.name} ({member.mention})"
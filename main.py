@@ -1,10 +1,38 @@
 # Boots up bot!
-import bot
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import importlib
+
+# Imported one at a time, so --measure-startup shows what each adds on top of the previous ones
+STARTUP_IMPORTS = ('discord', 'dotenv', 'db.storage', 'constructors.team_builder', 'metrics', 'bot')
+
+
+def import_bot():
+    timings = []
+    for module in STARTUP_IMPORTS:
+        start = time.perf_counter()
+        importlib.import_module(module)
+        timings.append((f'import {module}', time.perf_counter() - start, time.perf_counter() - STARTED))
+
+    import metrics
+    metrics.set_process_start(STARTED)
+    for step, seconds, done_at in timings:
+        metrics.record_startup(step, seconds, done_at)
+    return importlib.import_module('bot')
+
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs VolleyBot.")
+    parser.add_argument('--measure-startup', action='store_true',
+                        help="Print how long imports, connecting and loading took once the bot is ready, then exit.")
+    args = parser.parse_args()
 
     # Runs the Bot
-    bot.run_bot()
+    bot = import_bot()
+    bot.run_bot(measure_startup=args.measure_startup)
     # atexit.register(lambda: save_data('player_data.csv', bot.save_players()))
 
 
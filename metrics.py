@@ -0,0 +1,260 @@
+"""
+In-process latency and I/O histograms for slash commands and events.
+
+A handler wrapped with @measure(name) records its total latency, the time and number of
+database round trips it waited on and the number of Discord REST calls it made. The
+counters follow the handler through contextvars, so queries run from gathered tasks
+count towards the command that started them.
+
+Startup steps are timed too, for main.py --measure-startup.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+
+from discord.webhook.async_ import async_context
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+class Histogram:
+    """
+    Counts observations in fixed buckets, like a Prometheus histogram.
+
+    Attributes:
+        buckets (tuple): The upper bound of each bucket.
+        counts (list[int]): The number of observations in each bucket, the last one above every bound.
+        total (float): The sum of all observations.
+        count (int): The number of observations.
+    """
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """
+        :param q: The quantile, between 0 and 1.
+        :return: The upper bound of the bucket holding the quantile, or infinity if it is above every bucket.
+        """
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return bound
+        return float('inf')
+
+
+class _Sample:
+    __slots__ = ('db_seconds', 'db_calls', 'rest_calls')
+
+    def __init__(self):
+        self.db_seconds = 0.0
+        self.db_calls = 0
+        self.rest_calls = 0
+
+
+class _HandlerStats:
+    def __init__(self):
+        self.seconds = Histogram(LATENCY_BUCKETS)
+        self.db_seconds = Histogram(LATENCY_BUCKETS)
+        self.db_calls = Histogram(COUNT_BUCKETS)
+        self.rest_calls = Histogram(COUNT_BUCKETS)
+        self.errors = 0
+
+
+_current: ContextVar[_Sample | None] = ContextVar('metrics_sample', default=None)
+_handlers: dict[str, _HandlerStats] = {}
+# Queries run with run_sync() record from a worker thread
+_db_lock = threading.Lock()
+
+
+def measure(name: str):
+    """
+    Records the latency and I/O of every call to an async handler.
+    Put it under @bot.tree.command so the command keeps its parameters.
+    :param name: The name the handler is reported under, ex. the command name.
+    :return: The decorator.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            sample = _Sample()
+            token = _current.set(sample)
+            start = time.perf_counter()
+            failed = False
+            try:
+                return await func(*args, **kwargs)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                _current.reset(token)
+                _record(name, time.perf_counter() - start, sample, failed)
+        return wrapper
+    return decorator
+
+
+def _record(name: str, seconds: float, sample: _Sample, failed: bool):
+    stats = _handlers.setdefault(name, _HandlerStats())
+    stats.seconds.observe(seconds)
+    stats.db_seconds.observe(sample.db_seconds)
+    stats.db_calls.observe(sample.db_calls)
+    stats.rest_calls.observe(sample.rest_calls)
+    stats.errors += failed
+    # A measured handler called from another one also counts towards the outer handler
+    parent = _current.get()
+    if parent is not None:
+        parent.db_seconds += sample.db_seconds
+        parent.db_calls += sample.db_calls
+        parent.rest_calls += sample.rest_calls
+
+
+def record_db_call(seconds: float):
+    """
+    Counts a database round trip towards the handler running it, if any.
+    :param seconds: How long the handler waited for it.
+    :return: None
+    """
+    sample = _current.get()
+    if sample is not None:
+        with _db_lock:
+            sample.db_seconds += seconds
+            sample.db_calls += 1
+
+
+def _counting(request):
+    @wraps(request)
+    async def counted(*args, **kwargs):
+        sample = _current.get()
+        if sample is not None:
+            sample.rest_calls += 1
+        return await request(*args, **kwargs)
+    return counted
+
+
+def count_rest_calls(client):
+    """
+    Counts every Discord REST call the client makes, including interaction responses
+    and followups, which go through the webhook adapter instead of the client's HTTP session.
+    :param client: The bot.
+    :return: None
+    """
+    client.http.request = _counting(client.http.request)
+    adapter = async_context.get()
+    adapter.request = _counting(adapter.request)
+
+
+def summary() -> list[dict]:
+    """
+    :return: One entry per handler, busiest first, with its call count, errors, mean and
+    p95 latency, and mean database time, database calls and REST calls per call.
+    """
+    rows = []
+    for name, stats in _handlers.items():
+        rows.append({
+            'name': name,
+            'count': stats.seconds.count,
+            'errors': stats.errors,
+            'mean_seconds': stats.seconds.mean(),
+            'p95_seconds': stats.seconds.quantile(0.95),
+            'mean_db_seconds': stats.db_seconds.mean(),
+            'mean_db_calls': stats.db_calls.mean(),
+            'mean_rest_calls': stats.rest_calls.mean(),
+        })
+    return sorted(rows, key=lambda row: row['count'], reverse=True)
+
+
+def _format_bound(bound: float) -> str:
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def prometheus_text() -> str:
+    """
+    Dumps every histogram in the Prometheus text exposition format.
+    :return: The metrics as text.
+    """
+    families = (
+        ('volleybot_handler_seconds', 'Total handler latency in seconds.', 'seconds'),
+        ('volleybot_handler_db_seconds', 'Time a handler spent waiting on the database, in seconds.', 'db_seconds'),
+        ('volleybot_handler_db_calls', 'Database round trips per handler call.', 'db_calls'),
+        ('volleybot_handler_rest_calls', 'Discord REST calls per handler call.', 'rest_calls'),
+    )
+    lines = []
+    for metric, description, attribute in families:
+        lines.append(f'# HELP {metric} {description}')
+        lines.append(f'# TYPE {metric} histogram')
+        for name, stats in sorted(_handlers.items()):
+            histogram = getattr(stats, attribute)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{handler="{name}",le="{_format_bound(bound)}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{handler="{name}"}} {histogram.total}')
+            lines.append(f'{metric}_count{{handler="{name}"}} {histogram.count}')
+    lines.append('# HELP volleybot_handler_errors_total Handler calls that raised an exception.')
+    lines.append('# TYPE volleybot_handler_errors_total counter')
+    for name, stats in sorted(_handlers.items()):
+        lines.append(f'volleybot_handler_errors_total{{handler="{name}"}} {stats.errors}')
+    return '\n'.join(lines) + '\n'
+
+
+_process_start = time.perf_counter()
+_startup: list[tuple[str, float, float]] = []
+
+
+def set_process_start(started: float):
+    """
+    :param started: time.perf_counter() at the very start of the process, before any imports.
+    :return: None
+    """
+    global _process_start
+    _process_start = started
+
+
+def record_startup(step: str, seconds: float, done_at: float | None = None):
+    """
+    Records how long a startup step took, and when it finished.
+    :param step: The name of the step.
+    :param seconds: How long it took.
+    :param done_at: Seconds since the process started when it finished, by default now.
+    :return: None
+    """
+    _startup.append((step, seconds, time.perf_counter() - _process_start if done_at is None else done_at))
+
+
+async def timed_startup(step: str, awaitable):
+    """
+    Awaits a startup step and records how long it took.
+    :param step: The name of the step.
+    :param awaitable: The step.
+    :return: Whatever the step returns.
+    """
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        record_startup(step, time.perf_counter() - start)
+
+
+def startup_report() -> str:
+    """
+    :return: Every recorded startup step with its duration and when it finished, in order of finishing.
+    """
+    lines = [f"{'step':32} {'took':>8} {'done at':>8}"]
+    for step, seconds, done_at in sorted(_startup, key=lambda entry: entry[2]):
+        lines.append(f"{step:32} {seconds:7.3f}s {done_at:7.3f}s")
+    return '\n'.join(lines)
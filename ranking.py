@@ -0,0 +1,87 @@
+import asyncio
+from bisect import bisect_left, insort
+
+from db.repository import fetch_all, run_sync
+from db.storage import get_client
+
+# Every player with at least one game, kept sorted best first as (-elo, user id)
+_order: list[tuple[int, int]] = []
+_elos: dict[int, int] = {}
+_games: dict[int, int] = {}
+_loaded = False
+_load_lock = asyncio.Lock()
+
+
+async def load_ranking():
+    """
+    Reads every rated player once and sorts them. Later calls do nothing.
+    :return: None
+    """
+    global _loaded
+    async with _load_lock:
+        if _loaded:
+            return
+        db_client = get_client()
+        users = await run_sync(fetch_all, lambda: db_client.table('users').select('id, elo, games_played').gt('games_played', 0).order('id'))
+        _order.clear()
+        _elos.clear()
+        _games.clear()
+        for user in users:
+            _elos[user['id']] = user['elo']
+            _games[user['id']] = user['games_played']
+        _order.extend(sorted((-elo, user_id) for user_id, elo in _elos.items()))
+        _loaded = True
+        print(f"Loaded ranking of {len(_order)} players")
+
+
+def update_ranking(users: list[dict]):
+    """
+    Moves players to their new place after their ratings were written.
+    Does nothing until the ranking is loaded, since the load reads the new ratings anyway.
+    :param users: The users rows that were written, with id, elo and games_played.
+    :return: None
+    """
+    if not _loaded:
+        return
+    for user in users:
+        user_id = user['id']
+        if user_id in _elos:
+            del _order[bisect_left(_order, (-_elos.pop(user_id), user_id))]
+            del _games[user_id]
+        # A corrected or deleted match can leave a player with no games again
+        if user['games_played'] > 0:
+            _elos[user_id] = user['elo']
+            _games[user_id] = user['games_played']
+            insort(_order, (-user['elo'], user_id))
+
+
+def _rank_of(elo: int) -> int:
+    # Players on the same elo share the best rank among them
+    return bisect_left(_order, (-elo,)) + 1
+
+
+async def get_leaderboard(offset: int, limit: int) -> list[dict]:
+    """
+    :param offset: The number of players to skip from the top.
+    :param limit: The number of players to return.
+    :return: The players in rank order, with their rank, id, elo and games played.
+    """
+    await load_ranking()
+    return [{'rank': _rank_of(-negative_elo), 'id': user_id, 'elo': -negative_elo, 'games_played': _games[user_id]}
+            for negative_elo, user_id in _order[offset:offset + limit]]
+
+
+async def get_rank(user_id: int) -> dict | None:
+    """
+    :param user_id: The id of a player.
+    :return: The player's rank, elo, games played and the number of ranked players,
+    or None if they have not played a game yet.
+    """
+    await load_ranking()
+    if user_id not in _elos:
+        return None
+    return {'rank': _rank_of(_elos[user_id]), 'elo': _elos[user_id], 'games_played': _games[user_id], 'players': len(_order)}
+
+
+def ranked_players() -> int:
+    return len(_order)
@@ -0,0 +1,272 @@
+"""
+Recomputes players' Elo ratings from the match history.
+
+Every rating change is kept in rating_history, and every CHECKPOINT_INTERVAL matches the
+ratings of all players are saved to rating_checkpoints. Correcting or deleting a match
+only replays the matches after the nearest checkpoint before it (recompute_ratings).
+
+Run after changing the K-factors in elo.py to replay the full history:
+    python replay.py            # dry run, prints the difference against users.elo
+    python replay.py --apply    # writes the replayed ratings, rating history and checkpoints
+"""
+import argparse
+import time
+
+from db.repository import PAGE_SIZE, execute, fetch_all
+from db.storage import get_client
+from elo import rate_matches
+
+DEFAULT_ELO = 1000  # Default of users.elo
+CHECKPOINT_INTERVAL = 50  # Matches between rating checkpoints
+TEAM_CHUNK_SIZE = 200  # Team ids per roster request
+
+
+def load_history(db_client, after_match_id: int = 0) -> tuple[list[dict], dict[int, list[int]]]:
+    """
+    Loads the completed matches in the order they were played, and the roster of every team in them.
+    :param db_client: The storage client.
+    :param after_match_id: Only load the matches after this one.
+    :return: The completed matches and a dictionary of team id to its players' user ids.
+    """
+    matches = fetch_all(lambda: db_client.table('matches').select('id, team1_id, team2_id, winner_id')
+                        .eq('completed', True).gt('id', after_match_id).order('id'))
+    matches = [match for match in matches if match['winner_id'] is not None]
+    if not after_match_id:
+        team_members = fetch_all(lambda: db_client.table('team_members').select('team_id, user_id').order('id'))
+    else:
+        # Only the teams of recent matches, in chunks that keep the request URL short
+        team_ids = sorted({team_id for match in matches for team_id in (match['team1_id'], match['team2_id'])})
+        team_members = []
+        for i in range(0, len(team_ids), TEAM_CHUNK_SIZE):
+            chunk = team_ids[i:i + TEAM_CHUNK_SIZE]
+            team_members += fetch_all(lambda: db_client.table('team_members').select('team_id, user_id').in_('team_id', chunk).order('id'))
+
+    rosters = {}
+    for member in team_members:
+        roster = rosters.setdefault(member['team_id'], [])
+        if member['user_id'] not in roster:
+            roster.append(member['user_id'])
+    return matches, rosters
+
+
+def _replay(matches: list[dict], rosters: dict[int, list[int]], start_elo: int, initial: dict[int, dict] | None,
+            record: bool) -> tuple[dict[int, dict], list[dict], list[dict]]:
+    initial = initial or {}
+    player_ids = set(initial) | {user_id for match in matches for team_id in (match['team1_id'], match['team2_id'])
+                                 for user_id in rosters.get(team_id, [])}
+    users = {user_id: {'id': user_id, **initial.get(user_id, {'elo': start_elo, 'games_played': 0})}
+             for user_id in sorted(player_ids)}
+    history, checkpoints = [], []
+    rated = 0
+    for match in matches:
+        # One match at a time, so a checkpoint can be taken after any of them
+        rated_users, match_history = rate_matches([match], rosters, users)
+        if not rated_users:
+            continue
+        if record:
+            history += match_history
+
+        rated += 1
+        if record and rated % CHECKPOINT_INTERVAL == 0:
+            checkpoints += [{'match_id': match['id'], 'user_id': user_id, 'elo': user['elo'], 'games_played': user['games_played']}
+                            for user_id, user in users.items() if user['games_played']]
+
+    ratings = {user_id: {'elo': user['elo'], 'games_played': user['games_played']} for user_id, user in users.items()}
+    return ratings, history, checkpoints
+
+
+def replay(matches: list[dict], rosters: dict[int, list[int]], start_elo: int = DEFAULT_ELO,
+           initial: dict[int, dict] | None = None) -> dict[int, dict]:
+    """
+    Replays matches in order, giving the same ratings as rate_results() would have.
+    :param matches: The completed matches, in the order they were played.
+    :param rosters: Dictionary of team id to its players' user ids.
+    :param start_elo: The rating players without an initial rating start at.
+    :param initial: Dictionary of user id to the elo and games_played they start from, ex. a checkpoint.
+    Everyone else starts at start_elo with no games played.
+    :return: Dictionary of user id to their replayed elo and games_played.
+    """
+    return _replay(matches, rosters, start_elo, initial, False)[0]
+
+
+def replay_with_history(matches: list[dict], rosters: dict[int, list[int]], start_elo: int = DEFAULT_ELO,
+                        initial: dict[int, dict] | None = None) -> tuple[dict[int, dict], list[dict], list[dict]]:
+    """
+    Like replay(), but also returns the rating_history rows of every match and the
+    rating_checkpoints rows taken every CHECKPOINT_INTERVAL matches.
+    :return: The replayed ratings, the history rows and the checkpoint rows.
+    """
+    return _replay(matches, rosters, start_elo, initial, True)
+
+
+def load_checkpoint(db_client, before_match_id: int) -> tuple[int, dict[int, dict]]:
+    """
+    Loads the latest rating checkpoint taken before a match.
+    :param db_client: The storage client.
+    :param before_match_id: The match the checkpoint has to come before.
+    :return: The id of the last match in the checkpoint (0 if there is none) and a dictionary
+    of user id to their elo and games_played at that point.
+    """
+    latest = execute(db_client.table('rating_checkpoints').select('match_id').lt('match_id', before_match_id).order('match_id', desc=True).limit(1)).data
+    if not latest:
+        return 0, {}
+    match_id = latest[0]['match_id']
+    rows = fetch_all(lambda: db_client.table('rating_checkpoints').select('user_id, elo, games_played').eq('match_id', match_id).order('id'))
+    return match_id, {row['user_id']: {'elo': row['elo'], 'games_played': row['games_played']} for row in rows}
+
+
+def load_ratings_before(db_client, after_match_id: int, user_ids: set[int]) -> dict[int, dict]:
+    """
+    Loads the ratings players had right after a match, from the rating history since then and
+    their current users row. A player with history since that match starts from the elo_before
+    of their first history row, with one game fewer per row than they have now. A player with
+    no history since has not been rated since, so starts from their current users row.
+    :param db_client: The storage client.
+    :param after_match_id: The last match the ratings have to include.
+    :param user_ids: The players to load.
+    :return: Dictionary of user id to their elo and games_played at that point.
+    """
+    history = fetch_all(lambda: db_client.table('rating_history').select('user_id, elo_before')
+                        .gt('match_id', after_match_id).order('match_id').order('id'))
+    first_elo, rated = {}, {}
+    for row in history:
+        first_elo.setdefault(row['user_id'], row['elo_before'])
+        rated[row['user_id']] = rated.get(row['user_id'], 0) + 1
+
+    user_ids = sorted(set(user_ids) | set(first_elo))
+    users = []
+    for i in range(0, len(user_ids), TEAM_CHUNK_SIZE):
+        chunk = user_ids[i:i + TEAM_CHUNK_SIZE]
+        users += fetch_all(lambda: db_client.table('users').select('id, elo, games_played').in_('id', chunk).order('id'))
+
+    ratings = {}
+    for user in users:
+        if user['id'] in first_elo:
+            ratings[user['id']] = {'elo': first_elo[user['id']],
+                                   'games_played': max(user['games_played'] - rated[user['id']], 0)}
+        else:
+            ratings[user['id']] = {'elo': user['elo'], 'games_played': user['games_played']}
+    return ratings
+
+
+def _insert_chunks(db_client, table: str, rows: list[dict]):
+    for i in range(0, len(rows), PAGE_SIZE):
+        execute(db_client.table(table).insert(rows[i:i + PAGE_SIZE]))
+
+
+def recompute_ratings(db_client, from_match_id: int, start_elo: int | None = None) -> list[dict]:
+    """
+    Replays every completed match from the nearest checkpoint before from_match_id, after
+    a match was corrected, deleted or completed out of order. Rewrites the rating history
+    and checkpoints after that checkpoint, and the ratings of everyone who played since.
+    Players who are not in the checkpoint start from their rating at that point, see
+    load_ratings_before().
+    :param db_client: The storage client.
+    :param from_match_id: The first match whose result changed.
+    :param start_elo: Start players who are not in the checkpoint at this rating with no games
+    played instead, ex. to rebuild every rating from the first match.
+    :return: The users rows that were written (id, elo, games_played).
+    """
+    checkpoint_id, initial = load_checkpoint(db_client, from_match_id)
+    matches, rosters = load_history(db_client, checkpoint_id)
+    old_history = fetch_all(lambda: db_client.table('rating_history').select('user_id').gt('match_id', checkpoint_id).order('id'))
+    played = {row['user_id'] for row in old_history} | {user_id for match in matches
+                                                       for team_id in (match['team1_id'], match['team2_id'])
+                                                       for user_id in rosters.get(team_id, [])}
+    if start_elo is None:
+        initial = {**load_ratings_before(db_client, checkpoint_id, played - set(initial)), **initial}
+    else:
+        initial = {**{user_id: {'elo': start_elo, 'games_played': 0} for user_id in played}, **initial}
+    ratings, history, checkpoints = replay_with_history(matches, rosters, initial=initial)
+
+    # Players who only played in a deleted match go back to their rating before it
+    users = [{'id': user_id, **ratings.get(user_id, initial[user_id])} for user_id in sorted(played) if user_id in initial]
+
+    execute(db_client.table('rating_history').delete().gt('match_id', checkpoint_id))
+    execute(db_client.table('rating_checkpoints').delete().gt('match_id', checkpoint_id))
+    _insert_chunks(db_client, 'rating_history', history)
+    _insert_chunks(db_client, 'rating_checkpoints', checkpoints)
+    for i in range(0, len(users), PAGE_SIZE):
+        execute(db_client.table('users').upsert(users[i:i + PAGE_SIZE]))
+    print(f"Replayed {len(matches)} matches after match {checkpoint_id} for {len(users)} players")
+    return users
+
+
+def checkpoint_ratings(db_client) -> bool:
+    """
+    Saves every player's rating as a checkpoint once CHECKPOINT_INTERVAL matches have been
+    rated since the last one.
+    :param db_client: The storage client.
+    :return: True if a checkpoint was saved.
+    """
+    latest = execute(db_client.table('rating_checkpoints').select('match_id').order('match_id', desc=True).limit(1)).data
+    checkpoint_id = latest[0]['match_id'] if latest else 0
+    rated = fetch_all(lambda: db_client.table('rating_history').select('match_id').gt('match_id', checkpoint_id).order('id'))
+    match_ids = {row['match_id'] for row in rated}
+    if len(match_ids) < CHECKPOINT_INTERVAL:
+        return False
+
+    users = fetch_all(lambda: db_client.table('users').select('id, elo, games_played').gt('games_played', 0).order('id'))
+    match_id = max(match_ids)
+    _insert_chunks(db_client, 'rating_checkpoints', [
+        {'match_id': match_id, 'user_id': user['id'], 'elo': user['elo'], 'games_played': user['games_played']} for user in users
+    ])
+    print(f"Saved a rating checkpoint of {len(users)} players after match {match_id}")
+    return True
+
+
+def diff_ratings(replayed: dict[int, dict], users: list[dict]) -> list[dict]:
+    """
+    Compares replayed ratings to the ratings currently stored in users.
+    :param replayed: Dictionary of user id to their replayed elo and games_played.
+    :param users: The users rows (id, elo, games_played).
+    :return: One row per player whose rating or games played would change.
+    """
+    current = {user['id']: user for user in users}
+    changes = []
+    for user_id, rating in replayed.items():
+        user = current.get(user_id, {'elo': None, 'games_played': None})
+        if user['elo'] != rating['elo'] or user['games_played'] != rating['games_played']:
+            changes.append({
+                'id': user_id,
+                'elo_before': user['elo'],
+                'elo_after': rating['elo'],
+                'games_before': user['games_played'],
+                'games_after': rating['games_played'],
+            })
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute every player's Elo rating from the match history.")
+    parser.add_argument('--apply', action='store_true', help="Write the replayed ratings to users. Without it nothing is written.")
+    parser.add_argument('--start-elo', type=int, help="Rating every player starts at. By default players start from "
+                                                       "their rating before their first match in the rating history.")
+    args = parser.parse_args()
+
+    db_client = get_client()
+    matches, rosters = load_history(db_client)
+    users = fetch_all(lambda: db_client.table('users').select('id, elo, games_played').order('id'))
+    initial = None
+    if args.start_elo is None:
+        initial = load_ratings_before(db_client, 0, {user_id for roster in rosters.values() for user_id in roster})
+
+    start = time.perf_counter()
+    replayed = replay(matches, rosters, DEFAULT_ELO if args.start_elo is None else args.start_elo, initial)
+    elapsed = time.perf_counter() - start
+    print(f"Replayed {len(matches)} matches for {len(replayed)} players in {elapsed:.2f}s")
+
+    changes = diff_ratings(replayed, users)
+    for change in changes:
+        print(f"{change['id']}: elo {change['elo_before']} -> {change['elo_after']}, "
+              f"games {change['games_before']} -> {change['games_after']}")
+    print(f"{len(changes)} players would change")
+
+    if args.apply:
+        # Replaying from the first match also rebuilds the history and checkpoints
+        users = recompute_ratings(db_client, 1, args.start_elo)
+        print(f"Updated {len(users)} players")
+
+
+if __name__ == '__main__':
+    main()
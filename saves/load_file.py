@@ -1,13 +1,34 @@
+"""
+Loads and saves player data, and moves players between a CSV file and the users table.
+
+    python -m saves.load_file import players.csv [--chunk-size 500]
+    python -m saves.load_file export players.csv [--chunk-size 500]
+
+Import streams the file, skips invalid rows and upserts the rest in chunks, one request per
+chunk (per set of filled-in columns in it). Empty cells leave an existing player's value as it
+is. It reads both exports and the old player_data.csv layout. A running bot keeps its ranking
+until it restarts.
+"""
+import argparse
 import csv
+import time
+from itertools import islice
 from typing import Any
 from constructors.player import Player
-from db.supabase import get_supabase_client
+from db.repository import PAGE_SIZE, fetch_pages
+from db.storage import get_client
 
-supabase = get_supabase_client()
+CHUNK_SIZE = 500  # Rows per upsert request
+MAX_ATTEMPTS = 3  # Tries per chunk before giving up
+RETRY_DELAY = 1.0  # Seconds before the first retry, doubled after each failure
+USER_COLUMNS = ('id', 'elo', 'games_played', 'rating_deviation', 'volatility')
+# Headers written by save_data_old, and the users columns they hold. Names and wins are not stored in users.
+LEGACY_HEADERS = {'Player ID': 'id', 'Elo Rating': 'elo', 'Total Games Played': 'games_played'}
 
 
 def load_data():
-    response = supabase.table('player_data').select("id, name, elo, wins, games_played").execute()
+    db_client = get_client()
+    response = db_client.table('player_data').select("id, name, elo, wins, games_played").execute()
     players_response = response.data
     players = {}
     for player in players_response:
@@ -16,14 +37,16 @@ def load_data():
     return players
 
 def save_data(players: dict[int, Player]):
-    for key, values in players.items():
-        supabase.table('player_data').upsert({
-            'id': key,
-            'name': values.name,
-            'elo': values.rating,
-            'wins': values.wins,
-            'games_played': values.games_played
-        }).execute()
+    db_client = get_client()
+    rows = ({
+        'id': key,
+        'name': values.name,
+        'elo': values.rating,
+        'wins': values.wins,
+        'games_played': values.games_played
+    } for key, values in players.items())
+    for chunk in chunked(rows, CHUNK_SIZE):
+        upsert_chunk(db_client, 'player_data', chunk)
 
 def load_data_old(file: str) -> dict[int, Player] | dict[Any, Any]:
     """
@@ -38,7 +61,6 @@ def load_data_old(file: str) -> dict[int, Player] | dict[Any, Any]:
             csv_reader = csv.reader(csv_file)
             next(csv_reader, None)
             for row in csv_reader:
-                print(row)
                 player_num = int(row[0])
                 player_name = row[1]
                 player_ranking = int(row[2]) if row[2] else 0
@@ -68,3 +90,150 @@ def save_data_old(file: str, players: dict[int, Player]):
 
     except FileNotFoundError:
         print("File not Found")
+
+
+def chunked(rows, size: int):
+    """
+    :param rows: Any iterable, ex. a generator of rows.
+    :param size: The number of rows per chunk.
+    :return: Generator of lists of up to size rows.
+    """
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def upsert_chunk(db_client, table: str, rows: list[dict]):
+    """
+    Upserts rows in one request, retrying with a growing delay if it fails.
+    :param db_client: The storage client.
+    :param table: The table to upsert into.
+    :param rows: The rows, all with the same columns.
+    :return: None
+    """
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            db_client.table(table).upsert(rows).execute()
+            return
+        except Exception as error:
+            if attempt == MAX_ATTEMPTS:
+                raise
+            delay = RETRY_DELAY * 2 ** (attempt - 1)
+            print(f"Upserting {len(rows)} rows into {table} failed ({error}), retrying in {delay:.0f}s")
+            time.sleep(delay)
+
+
+def validate_row(row: dict[str, str]) -> dict:
+    """
+    Converts a CSV row to a users row.
+    :param row: The row's values by users column.
+    :return: The users row, without the columns whose value is empty, so an upsert keeps what
+    an existing player has in them and a new player gets the column's default.
+    """
+    if not row.get('id', '').strip():
+        raise ValueError("missing id")
+    user = {}
+    for column, value in row.items():
+        value = value.strip()
+        if column != 'id' and not value:
+            continue
+        try:
+            user[column] = int(value) if column in ('id', 'elo', 'games_played') else float(value)
+        except ValueError:
+            raise ValueError(f"{column} is not a number: {value!r}") from None
+    if user['id'] <= 0:
+        raise ValueError(f"invalid id: {user['id']}")
+    if user.get('games_played', 0) < 0:
+        raise ValueError(f"negative games_played: {user['games_played']}")
+    for column in ('rating_deviation', 'volatility'):
+        if user.get(column, 1) <= 0:
+            raise ValueError(f"{column} must be positive: {user[column]}")
+    return user
+
+
+def read_players(file: str, skipped: list[tuple[int, str]]):
+    """
+    Streams the valid players of a CSV file, one row at a time.
+    :param file: The .csv file, with a header row.
+    :param skipped: Gets the line number and reason of every invalid row.
+    :return: Generator of users rows, with the columns of the header that have a value.
+    """
+    with open(file, newline='') as csv_file:
+        csv_reader = csv.DictReader(csv_file)
+        columns = {header: LEGACY_HEADERS.get(header, header) for header in csv_reader.fieldnames or []}
+        columns = {header: column for header, column in columns.items() if column in USER_COLUMNS}
+        if 'id' not in columns.values():
+            raise ValueError(f"{file} has no id column")
+        for row in csv_reader:
+            try:
+                yield validate_row({column: row[header] or '' for header, column in columns.items()})
+            except ValueError as error:
+                skipped.append((csv_reader.line_num, str(error)))
+
+
+def import_players(file: str, chunk_size: int = CHUNK_SIZE) -> tuple[int, list[tuple[int, str]]]:
+    """
+    Upserts the players of a CSV file into users, one request per chunk and set of filled-in columns.
+    :param file: The .csv file.
+    :param chunk_size: The number of players per request.
+    :return: The number of rows written, and the line number and reason of every skipped row.
+    """
+    db_client = get_client()
+    skipped = []
+    imported = 0
+    for chunk in chunked(read_players(file, skipped), chunk_size):
+        # One upsert cannot write the same row twice, so the last row of a duplicated id wins
+        chunk = list({user['id']: user for user in chunk}.values())
+        # Rows of one upsert must have the same columns, or the missing ones are written as null
+        by_columns = {}
+        for user in chunk:
+            by_columns.setdefault(tuple(user), []).append(user)
+        for rows in by_columns.values():
+            upsert_chunk(db_client, 'users', rows)
+        imported += len(chunk)
+        print(f"Imported {imported} rows")
+    return imported, skipped
+
+
+def export_players(file: str, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Writes every users row to a CSV file, reading one page at a time.
+    :param file: The .csv file to write.
+    :param chunk_size: The number of players per request, at most PAGE_SIZE.
+    :return: The number of players written.
+    """
+    db_client = get_client()
+    exported = 0
+    with open(file, 'w', newline='') as csv_file:
+        csv_writer = csv.DictWriter(csv_file, fieldnames=USER_COLUMNS)
+        csv_writer.writeheader()
+        pages = fetch_pages(lambda: db_client.table('users').select(', '.join(USER_COLUMNS)).order('id'), min(chunk_size, PAGE_SIZE))
+        for page in pages:
+            csv_writer.writerows(page)
+            exported += len(page)
+            print(f"Exported {exported} players")
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import players from a CSV file into users, or export users to one.")
+    parser.add_argument('action', choices=('import', 'export'))
+    parser.add_argument('file', help="The .csv file to read or write.")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Players per request.")
+    args = parser.parse_args()
+    if args.chunk_size <= 0:
+        parser.error("--chunk-size must be positive")
+
+    start = time.perf_counter()
+    if args.action == 'import':
+        imported, skipped = import_players(args.file, args.chunk_size)
+        for line, reason in skipped:
+            print(f"Skipped line {line}: {reason}")
+        print(f"Imported {imported} rows, skipped {len(skipped)} rows in {time.perf_counter() - start:.2f}s")
+    else:
+        exported = export_players(args.file, args.chunk_size)
+        print(f"Exported {exported} players in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    main()